@@ -0,0 +1,145 @@
+import datetime
+import time
+from array import array
+from collections import Counter
+
+from smart import date_ordinal, day_number
+
+# NumPy is optional: with it the aggregates are vectorized group-bys over integer
+# arrays, without it the same arrays are aggregated in plain Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Circulation reports over the loans and reservations on record (returned loans are
+# not kept, so loan lengths are the ages of the open loans). The records are copied
+# once into integer columns: member and book IDs become codes (positions in
+# member_ids / book_ids, in order of first appearance) and dates become day
+# ordinals, -1 when malformed.
+class Circulation:
+    def __init__(self, library, as_of=None, use_numpy=None):
+        self.as_of = day_number(as_of)
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        if self.use_numpy and np is None:
+            raise RuntimeError("NumPy is not installed.")
+
+        self.library = library
+        with library.lock:
+            borrows = [(borrow.member_id, borrow.book_id, borrow.borrow_date) for borrow in library.borrows]
+            reservations = [(reservation.member_id, reservation.book_id, reservation.reservation_date)
+                            for reservation in library.reservations]
+        self.member_ids = []
+        self.book_ids = []
+        member_codes = {}
+        book_codes = {}
+
+        self.borrow_member, self.borrow_book, self.borrow_day = self.columns(borrows, member_codes, book_codes)
+        self.reservation_member, self.reservation_book, self.reservation_day = \
+            self.columns(reservations, member_codes, book_codes)
+
+    # (member codes, book codes, day ordinals) of (member_id, book_id, date) rows
+    def columns(self, rows, member_codes, book_codes):
+        members = array('q')
+        books = array('q')
+        days = array('q')
+        for member_id, book_id, date in rows:
+            code = member_codes.get(member_id)
+            if code is None:
+                code = member_codes[member_id] = len(self.member_ids)
+                self.member_ids.append(member_id)
+            members.append(code)
+            code = book_codes.get(book_id)
+            if code is None:
+                code = book_codes[book_id] = len(self.book_ids)
+                self.book_ids.append(book_id)
+            books.append(code)
+            day = date_ordinal(date)
+            days.append(-1 if day is None else day)
+        if self.use_numpy:
+            return np.frombuffer(members, np.int64), np.frombuffer(books, np.int64), np.frombuffer(days, np.int64)
+        return members, books, days
+
+    # [(ISO date, loans started that day)] in date order
+    def borrows_per_day(self):
+        if self.use_numpy:
+            days = self.borrow_day[self.borrow_day >= 0]
+            values, counts = np.unique(days, return_counts=True)
+            pairs = zip(values.tolist(), counts.tolist())
+        else:
+            pairs = sorted(Counter(day for day in self.borrow_day if day >= 0).items())
+        return [(datetime.date.fromordinal(day).isoformat(), count) for day, count in pairs]
+
+    # Days the open loans have run as of the report date: count, mean, median, max
+    def loan_lengths(self):
+        if self.use_numpy:
+            days = self.borrow_day[self.borrow_day >= 0]
+            if not len(days):
+                return {'loans': 0, 'mean_days': None, 'median_days': None, 'max_days': None}
+            lengths = self.as_of - days
+            return {'loans': int(len(lengths)), 'mean_days': float(lengths.mean()),
+                    'median_days': float(np.median(lengths)), 'max_days': int(lengths.max())}
+        lengths = sorted(self.as_of - day for day in self.borrow_day if day >= 0)
+        if not lengths:
+            return {'loans': 0, 'mean_days': None, 'median_days': None, 'max_days': None}
+        middle = len(lengths) // 2
+        median = lengths[middle] if len(lengths) % 2 else (lengths[middle - 1] + lengths[middle]) / 2
+        return {'loans': len(lengths), 'mean_days': sum(lengths) / len(lengths),
+                'median_days': float(median), 'max_days': lengths[-1]}
+
+    # Codes and counts of the top k by count, ties to the lower code
+    def top(self, counts, k):
+        if self.use_numpy:
+            order = np.lexsort((np.arange(len(counts)), -counts))[:k]
+            return [(code, count) for code, count in zip(order.tolist(), counts[order].tolist()) if count]
+        ranked = sorted(((count, code) for code, count in enumerate(counts) if count), key=lambda pair: (-pair[0], pair[1]))
+        return [(code, count) for count, code in ranked[:k]]
+
+    def counts(self, codes, size):
+        if self.use_numpy:
+            return np.bincount(codes, minlength=size)
+        counts = [0] * size
+        for code in codes:
+            counts[code] += 1
+        return counts
+
+    # [(book_id, title, reservations)] for the k most reserved books
+    def most_reserved(self, k=10):
+        counts = self.counts(self.reservation_book, len(self.book_ids))
+        results = []
+        for code, count in self.top(counts, k):
+            book = self.library.get_book(self.book_ids[code])
+            results.append((self.book_ids[code], book.title if book else '', count))
+        return results
+
+    # [(member_id, name, open loans, reservations)] for the k most active members
+    def member_activity(self, k=10):
+        loans = self.counts(self.borrow_member, len(self.member_ids))
+        reservations = self.counts(self.reservation_member, len(self.member_ids))
+        if self.use_numpy:
+            totals = loans + reservations
+        else:
+            totals = [a + b for a, b in zip(loans, reservations)]
+        results = []
+        for code, _ in self.top(totals, k):
+            member = self.library.get_member(self.member_ids[code])
+            results.append((self.member_ids[code], member.name if member else '', int(loans[code]), int(reservations[code])))
+        return results
+
+# Every report, with the seconds each took (loading the columns included), as
+# (reports, timings)
+def circulation_report(library, as_of=None, top=10, use_numpy=None):
+    timings = {}
+    start = time.perf_counter()
+    circulation = Circulation(library, as_of, use_numpy)
+    timings['load'] = time.perf_counter() - start
+    reports = {}
+    for name, function, args in (('borrows_per_day', circulation.borrows_per_day, ()),
+                                 ('loan_lengths', circulation.loan_lengths, ()),
+                                 ('most_reserved', circulation.most_reserved, (top,)),
+                                 ('member_activity', circulation.member_activity, (top,))):
+        start = time.perf_counter()
+        reports[name] = function(*args)
+        timings[name] = time.perf_counter() - start
+    reports['backend'] = 'numpy' if circulation.use_numpy else 'python'
+    return reports, timings
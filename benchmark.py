@@ -0,0 +1,404 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import analytics
+import parallel_load
+import replicas
+import smart
+from changefeed import CHANGES_FILE_NAME, ChangeFeed
+from search_index import FuzzyIndex, PrefixIndex
+
+# Catalog sizes the suite knows by name
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+FIRST_WORDS = ['The', 'A', 'Last', 'Silent', 'Hidden', 'Great', 'Lost', 'Broken', 'Secret', 'Little']
+SECOND_WORDS = ['Garden', 'River', 'Empire', 'Mockingbird', 'Gatsby', 'Winter', 'Ocean', 'Library', 'Crown', 'Prejudice']
+SURNAMES = ['Lee', 'Austen', 'Orwell', 'Fitzgerald', 'Salinger', 'Morrison', 'Tolstoy', 'Woolf', 'Achebe', 'Murakami']
+
+# Row counts of every table for a catalog of the given number of books.
+# Books 1..borrows are on loan, and every reservation is for one of them.
+def table_sizes(books):
+    return {
+        'books': books,
+        'members': max(1, books // 7),
+        'borrows': books // 10,
+        'reservations': books // 20,
+    }
+
+# Seeded synthetic rows for every table, as {file name: (header, row iterator)}
+def generate_tables(books, seed=0):
+    rng = random.Random(seed)
+    sizes = table_sizes(books)
+    members = sizes['members']
+    borrows = sizes['borrows']
+    start = datetime.date(2023, 1, 1).toordinal()
+
+    def book_rows():
+        for book_id in range(1, books + 1):
+            title = f"{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)} {book_id}"
+            author = f"{rng.choice('ABCDEFGHJKLMNPRSTW')}. {rng.choice(SURNAMES)}"
+            yield [book_id, title, author, 9780000000000 + book_id, book_id > borrows]
+
+    def member_rows():
+        for member_id in range(1, members + 1):
+            yield [member_id, f"Member {member_id}", f"member{member_id}@example.com"]
+
+    def borrow_rows():
+        for borrow_id in range(1, borrows + 1):
+            borrowed = start + rng.randrange(365)
+            yield [borrow_id, rng.randint(1, members), borrow_id,
+                   datetime.date.fromordinal(borrowed).isoformat(),
+                   datetime.date.fromordinal(borrowed + 30).isoformat()]
+
+    def reservation_rows():
+        for reservation_id in range(1, sizes['reservations'] + 1):
+            reserved = start + rng.randrange(365)
+            yield [reservation_id, rng.randint(1, members), rng.randint(1, max(1, borrows)),
+                   datetime.date.fromordinal(reserved).isoformat(), smart.PENDING, '']
+
+    return {
+        smart.BOOKS_FILE_NAME: (smart.BOOK_HEADER, book_rows()),
+        smart.MEMBERS_FILE_NAME: (smart.MEMBER_HEADER, member_rows()),
+        smart.BORROWS_FILE_NAME: (smart.BORROW_HEADER, borrow_rows()),
+        smart.RESERVATIONS_FILE_NAME: (smart.RESERVATION_HEADER, reservation_rows()),
+    }
+
+# Write a synthetic, seeded data set of the given size into data_dir as .dat files
+def generate_dataset(data_dir, books, seed=0):
+    os.makedirs(data_dir, exist_ok=True)
+    for file_name, (header, rows) in generate_tables(books, seed).items():
+        with open(os.path.join(data_dir, file_name), 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+# Latency distribution and throughput of a list of per-call durations in seconds
+def latency_stats(durations):
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        'calls': len(durations),
+        'throughput_per_second': len(durations) / total if total else None,
+        'mean_ms': 1000 * total / len(durations) if durations else None,
+        'p50_ms': 1000 * percentile(durations, 0.50) if durations else None,
+        'p90_ms': 1000 * percentile(durations, 0.90) if durations else None,
+        'p99_ms': 1000 * percentile(durations, 0.99) if durations else None,
+        'max_ms': 1000 * durations[-1] if durations else None,
+    }
+
+# Time every call of function over argument tuples
+def measure(function, calls):
+    durations = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+    return latency_stats(durations)
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+# Cold-start time of LibraryManager from the CSV files and from the binary snapshot
+def bench_startup(books, repeat=3, seed=0):
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        csv_times = []
+        for _ in range(repeat):
+            elapsed, library = timed(smart.LibraryManager, data_dir, use_snapshot=False)
+            csv_times.append(elapsed)
+        library.save_snapshot()
+        snapshot_times = []
+        for _ in range(repeat):
+            elapsed, library = timed(smart.LibraryManager, data_dir)
+            snapshot_times.append(elapsed)
+        return {
+            'benchmark': 'startup',
+            'books': books,
+            'csv_seconds': min(csv_times),
+            'snapshot_seconds': min(snapshot_times),
+            'speedup': min(csv_times) / min(snapshot_times),
+        }
+
+# Load, query and mutation timings for one catalog size
+def bench_operations(books, ops=1000, write_ops=20, journaled=False, write_behind=False, durability='none',
+                     change_log=False, seed=0):
+    rng = random.Random(seed + 1)
+    sizes = table_sizes(books)
+    results = {'benchmark': 'operations', 'books': books, 'tables': sizes, 'journaled': journaled,
+               'write_behind': write_behind, 'durability': durability, 'change_log': change_log}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        elapsed, _ = timed(generate_dataset, data_dir, books, seed)
+        results['generate_seconds'] = elapsed
+
+        elapsed, library = timed(smart.LibraryManager, data_dir, journaled=journaled, use_snapshot=False,
+                                 write_behind=write_behind, durability=durability)
+        results['load_seconds'] = elapsed
+        results['load_rows_per_second'] = sum(sizes.values()) / elapsed
+        results['load_seconds_by_file'] = {
+            kind: timed(getattr(library, 'load_' + kind))[0]
+            for kind in ('books', 'borrows', 'reservations', 'members')
+        }
+        feed = ChangeFeed(library, os.path.join(data_dir, CHANGES_FILE_NAME)) if change_log else None
+
+        queries = [(rng.choice(SECOND_WORDS).lower(),) for _ in range(ops // 2)]
+        queries += [(f"{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)} {rng.randint(1, books)}",)
+                    for _ in range(ops - ops // 2)]
+        results['search_books'] = measure(library.search_books, queries)
+
+        on_loan = max(1, sizes['borrows'])
+        reservations = [(str(rng.randint(1, sizes['members'])), str(rng.randint(1, on_loan))) for _ in range(write_ops)]
+        results['make_reservation'] = measure(library.make_reservation, reservations)
+
+        available = rng.sample(range(on_loan + 1, books + 1), min(write_ops, books - on_loan))
+        borrows = [(str(rng.randint(1, sizes['members'])), str(book_id)) for book_id in available]
+        first_borrow_id = library.last_borrow_id + 1
+        results['borrow_book'] = measure(library.borrow_book, borrows)
+        returns = [(str(borrow_id),) for borrow_id in range(first_borrow_id, library.last_borrow_id + 1)]
+        results['return_book'] = measure(library.return_book, returns)
+        # What write-behind mode still owes the disk after those changes
+        results['flush_seconds'] = timed(library.flush)[0]
+
+        # One batch of returns of loaned books, most with reservations waiting,
+        # each copy handed to its next reservation and every file persisted once
+        batch = [str(borrow_id) for borrow_id in rng.sample(range(1, on_loan + 1), min(ops, sizes['borrows']))]
+        elapsed, (returned, holds, _, _) = timed(library.process_returns, batch)
+        results['process_returns'] = {'returns': len(returned), 'holds': len(holds), 'seconds': elapsed}
+
+        results['get_book_summary'] = measure(library.get_book_summary, [()] * 3)
+
+        for kind in ('books', 'borrows', 'reservations', 'members'):
+            results['save_' + kind] = measure(getattr(library, 'save_' + kind), [()] * 3)
+
+        library.close()
+        if feed is not None:
+            results['change_events'] = feed.sequence
+            results['change_log_bytes'] = os.path.getsize(feed.path)
+            feed.close()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+# Search throughput of the in-process index against read replicas with
+# each number of worker processes
+def bench_replicas(books, ops=1000, workers=(1, 2, 4), seed=0):
+    rng = random.Random(seed + 2)
+    queries = [rng.choice(SECOND_WORDS).lower() for _ in range(ops // 2)]
+    queries += [f"{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)} {rng.randint(1, books)}"
+                for _ in range(ops - ops // 2)]
+    results = {'benchmark': 'replicas', 'books': books, 'queries': ops}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        library = smart.LibraryManager(data_dir, use_snapshot=False)
+        elapsed, _ = timed(lambda: [library.search_books(query) for query in queries])
+        results['in_process_per_second'] = ops / elapsed
+
+        elapsed, publisher = timed(replicas.CatalogPublisher, library)
+        results['publish_seconds'] = elapsed
+        results['replicas'] = []
+        for count in workers:
+            pool = replicas.ReplicaPool(publisher.path, count)
+            pool.count_many(queries[:count * 64])  # start the workers and map the catalog
+            elapsed, _ = timed(pool.count_many, queries)
+            pool.close()
+            results['replicas'].append({'workers': count, 'queries_per_second': ops / elapsed})
+        publisher.close()
+    return results
+
+# Parse time of books, borrows and reservations sequentially and with each number
+# of worker processes. The size threshold is lifted so small catalogs use the pool
+# too; speedups above one need as many free cores as workers.
+def bench_parallel_load(books, workers=(1, 2, 4), repeat=3, seed=0):
+    parallel_load.PARALLEL_MIN_BYTES = 0
+    results = {'benchmark': 'parallel_load', 'books': books, 'cpus': os.cpu_count(), 'tables': {}}
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        for kind in ('books', 'borrows', 'reservations'):
+            path = os.path.join(data_dir, getattr(smart, kind.upper() + '_FILE_NAME'))
+            sequential = min(timed(smart.read_table, path, kind, 1)[0] for _ in range(repeat))
+            rows = len(smart.read_table(path, kind, 1))
+            table = {'rows': rows, 'megabytes': os.path.getsize(path) / 1e6,
+                     'sequential_seconds': sequential, 'parallel': []}
+            for count in workers:
+                elapsed = min(timed(smart.read_table, path, kind, count)[0] for _ in range(repeat))
+                table['parallel'].append({'workers': count, 'seconds': elapsed,
+                                          'rows_per_second': rows / elapsed, 'speedup': sequential / elapsed})
+            results['tables'][kind] = table
+    return results
+
+# Circulation report timings with plain Python and, when it is installed, NumPy
+def bench_analytics(books, repeat=3, seed=0):
+    results = {'benchmark': 'analytics', 'books': books, 'backends': {}}
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        library = smart.LibraryManager(data_dir, use_snapshot=False)
+        for backend, use_numpy in (('python', False), ('numpy', True)):
+            if use_numpy and analytics.np is None:
+                results['backends'][backend] = None
+                continue
+            runs = [analytics.circulation_report(library, use_numpy=use_numpy)[1] for _ in range(repeat)]
+            results['backends'][backend] = {name: min(run[name] for run in runs) for name in runs[0]}
+    return results
+
+# A word with one random typo: a letter dropped, doubled, replaced or swapped
+# with the next one
+def misspell(word, rng):
+    position = rng.randrange(len(word) - 1)
+    edit = rng.choice(['drop', 'double', 'replace', 'swap'])
+    if edit == 'drop':
+        return word[:position] + word[position + 1:]
+    if edit == 'double':
+        return word[:position] + word[position] + word[position:]
+    if edit == 'replace':
+        return word[:position] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[position + 1:]
+    return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+
+# Fuzzy title search latency on misspelled queries: the catalog's title words with
+# a typo, alone and with the book number, and how often the intended book (for
+# the numbered queries) is in the top k
+def bench_fuzzy(books, ops=1000, k=10, seed=0):
+    rng = random.Random(seed + 3)
+    results = {'benchmark': 'fuzzy', 'books': books, 'k': k}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        library = smart.LibraryManager(data_dir, use_snapshot=False)
+        titles = [(book.book_id, book.title) for book in library.books]
+        index = FuzzyIndex()
+        elapsed, _ = timed(lambda: [index.add(book_id, title) for book_id, title in titles])
+        results['build_seconds'] = elapsed
+
+        words = [(misspell(rng.choice(SECOND_WORDS).lower(), rng),) for _ in range(ops // 2)]
+        results['word'] = measure(library.fuzzy_search, [query + (k,) for query in words])
+
+        targets = [rng.choice(titles) for _ in range(ops - ops // 2)]
+        numbered = []
+        for book_id, title in targets:
+            first, second, number = title.split()
+            numbered.append((f"{misspell(first.lower(), rng) if len(first) > 1 else first} "
+                             f"{misspell(second.lower(), rng)} {number}", k))
+        results['word_and_number'] = measure(library.fuzzy_search, numbered)
+        found = sum(any(book.book_id == book_id for book, _ in library.fuzzy_search(*query))
+                    for (book_id, _), query in zip(targets, numbered))
+        results['recall'] = found / len(targets) if targets else None
+        library.close()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+# Title autocomplete: building the index, completing prefixes one to ten characters
+# long taken from real titles, re-ranking books, and splicing in a full buffer of
+# new titles
+def bench_autocomplete(books, ops=1000, k=10, seed=0):
+    rng = random.Random(seed + 4)
+    results = {'benchmark': 'autocomplete', 'books': books, 'k': k}
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        library = smart.LibraryManager(data_dir, use_snapshot=False)
+        entries = [(book.book_id, book.title, library.book_demand(book.book_id)) for book in library.books]
+        elapsed, index = timed(PrefixIndex, entries)
+        results['build_seconds'] = elapsed
+
+        titles = [title for _, title, _ in entries]
+        prefixes = []
+        for _ in range(ops):
+            title = rng.choice(titles)
+            prefixes.append((title[:rng.randint(1, min(10, len(title)))], k))
+        results['complete'] = measure(library.autocomplete, prefixes)
+
+        book_ids = [book_id for book_id, _, _ in entries]
+        results['set_score'] = measure(index.set_score, [(rng.choice(book_ids), rng.randint(0, 5)) for _ in range(ops)])
+
+        for number in range(index.BUFFER_LIMIT):
+            index.add(f"new{number}", f"{rng.choice(FIRST_WORDS)} {number}")
+        results['merge_seconds'], _ = timed(index.merge)
+        library.close()
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+# Run one benchmark in a fresh process so peak memory is measured per data set,
+# with the manager's console output discarded
+def run_isolated(function, *args):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(quiet, function, *args).result()
+
+def quiet(function, *args):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return function(*args)
+
+def main():
+    parser = argparse.ArgumentParser(description="LibraryManager benchmark suite")
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'],
+                        help="catalog sizes: " + ", ".join(SIZES) + " or a number of books")
+    parser.add_argument('--suite', choices=['startup', 'operations', 'replicas', 'fuzzy', 'autocomplete', 'parallel_load', 'analytics', 'all'], default='all')
+    parser.add_argument('--ops', type=int, default=1000, help="calls per read benchmark")
+    parser.add_argument('--write-ops', type=int, default=20, help="calls per benchmark that rewrites files")
+    parser.add_argument('--journaled', action='store_true', help="run mutations in journaled mode")
+    parser.add_argument('--write-behind', action='store_true', help="save through the background flusher")
+    parser.add_argument('--durability', choices=smart.DURABILITY_LEVELS, default='none', help="when the manager fsyncs")
+    parser.add_argument('--change-log', action='store_true', help="log every change to a change feed while mutating")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="replica and loader worker counts to compare")
+    parser.add_argument('--k', type=int, default=10, help="results per fuzzy search or autocomplete")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'results': [],
+    }
+    for size in args.sizes:
+        books = SIZES.get(size.lower()) or int(size)
+        if args.suite in ('startup', 'all'):
+            report['results'].append(run_isolated(bench_startup, books, args.repeat, args.seed))
+        if args.suite in ('operations', 'all'):
+            report['results'].append(run_isolated(bench_operations, books, args.ops, args.write_ops, args.journaled,
+                                                      args.write_behind, args.durability, args.change_log, args.seed))
+        if args.suite in ('replicas', 'all'):
+            report['results'].append(run_isolated(bench_replicas, books, args.ops, args.workers, args.seed))
+        if args.suite in ('parallel_load', 'all'):
+            report['results'].append(run_isolated(bench_parallel_load, books, args.workers, args.repeat, args.seed))
+        if args.suite in ('analytics', 'all'):
+            report['results'].append(run_isolated(bench_analytics, books, args.repeat, args.seed))
+        if args.suite in ('fuzzy', 'all'):
+            report['results'].append(run_isolated(bench_fuzzy, books, args.ops, args.k, args.seed))
+        if args.suite in ('autocomplete', 'all'):
+            report['results'].append(run_isolated(bench_autocomplete, books, args.ops, args.k, args.seed))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
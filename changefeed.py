@@ -0,0 +1,214 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+from smart import ROW_WRITERS, SNAPSHOT_TABLES
+
+# Change-data-capture feed of LibraryManager mutations. Every persisted change
+# becomes a ChangeEvent numbered one past the last, handed to in-process
+# subscribers and appended as one JSON line to the change log, so downstream
+# systems read what changed since the offset they stopped at instead of
+# re-reading the .dat files.
+#
+# Events follow persistence: a change is logged once its .dat file or journal has
+# it (write-behind managers journal their changes while a feed is attached), and
+# each record's changes are numbered in the order they were made. A crash between
+# the two can lose the event of a saved change, but never logs one that was lost.
+# So can a failed log write: the change stays saved, its events are reported and
+# dropped without using up sequence numbers, and the log is reopened on the next
+# change. When the log is reopened, numbering carries on from its last event.
+
+CHANGES_FILE_NAME = 'changes.log'
+
+# Event types per table: (created, updated, deleted)
+EVENT_TYPES = {
+    'books': ('book_created', 'book_updated', 'book_deleted'),
+    'borrows': ('borrow_created', 'borrow_updated', 'borrow_deleted'),
+    'reservations': ('reservation_created', 'reservation_updated', 'reservation_deleted'),
+    'members': ('member_created', 'member_updated', 'member_deleted'),
+}
+
+# Bytes read at a time while looking for the last line of the log
+TAIL_CHUNK_SIZE = 64 * 1024
+
+# One change: row holds the record's columns as in its .dat file, None on delete
+class ChangeEvent:
+    __slots__ = ('sequence', 'type', 'table', 'key', 'row', 'time')
+
+    def __init__(self, sequence, type, table, key, row, time):
+        self.sequence = sequence
+        self.type = type
+        self.table = table
+        self.key = key
+        self.row = row
+        self.time = time
+
+def event_to_json(event):
+    return {'sequence': event.sequence, 'type': event.type, 'table': event.table, 'key': event.key,
+            'row': event.row, 'time': event.time}
+
+def event_from_json(data):
+    return ChangeEvent(data['sequence'], data['type'], data['table'], data['key'], data['row'], data['time'])
+
+# Offset just past the last newline before end, 0 when there is none
+def line_start(file, end):
+    while end > 0:
+        start = max(0, end - TAIL_CHUNK_SIZE)
+        file.seek(start)
+        newline = file.read(end - start).rfind(b'\n')
+        if newline != -1:
+            return start + newline + 1
+        end = start
+    return 0
+
+# Open the log for appending, cutting off a line left half-written by a crash, as
+# (file, sequence of its last event or 0)
+def open_log(path):
+    file = open(path, 'a+b')
+    end = file.seek(0, os.SEEK_END)
+    position = line_start(file, end)
+    if position < end:
+        file.truncate(position)
+    if position == 0:
+        return file, 0
+    start = line_start(file, position - 1)
+    file.seek(start)
+    return file, json.loads(file.read(position - start))['sequence']
+
+# (event, offset of the next line) for each event logged at and after byte offset,
+# which is 0 or an offset had from here before. A line still being written is left
+# for the next read.
+def iter_changes(path, offset=0):
+    try:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                yield event_from_json(json.loads(line)), offset
+    except FileNotFoundError:
+        pass
+
+# Up to limit events logged from offset on, as (events, offset to read from next)
+def read_changes(path, offset=0, limit=None):
+    events = []
+    for event, next_offset in iter_changes(path, offset):
+        if limit is not None and len(events) >= limit:
+            break
+        events.append(event)
+        offset = next_offset
+    return events, offset
+
+# Tail the log from offset for good, yielding (event, offset after it) as events
+# are appended; the log need not exist yet
+def follow(path, offset=0, poll_interval=0.5):
+    while True:
+        caught_up = True
+        for event, offset in iter_changes(path, offset):
+            caught_up = False
+            yield event, offset
+        if caught_up:
+            time.sleep(poll_interval)
+
+# Turns the changes a LibraryManager persists into numbered events. With a path,
+# events are appended to that log (fsynced before the mutation returns with sync);
+# without one they only reach subscribers.
+#
+# Subscribers are called in sequence order while the changed file is still locked,
+# so they should be quick and must not change the library themselves. One that
+# raises is reported and the others still get the event. Subscribers only get
+# events that made it into the log.
+class ChangeFeed:
+    def __init__(self, library, path=None, sync=False):
+        self.library = library
+        self.path = path
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.subscribers = []  # (callback, set of event types or None for all)
+        self.file = None
+        self.sequence = 0
+        if path is not None:
+            self.file, self.sequence = open_log(path)
+        self.journaled_before = library.journal_write_behind
+        library.journal_write_behind = True
+        library.change_listeners.append(self.on_change)
+
+    # Call callback(event) for every event from now on, only those of the given
+    # types if any. With offset, the events logged from there are delivered first,
+    # with no gap or repeat before the live ones.
+    def subscribe(self, callback, types=None, offset=None):
+        types = set(types) if types is not None else None
+        with self.lock:
+            if offset is not None and self.path is not None:
+                events, _ = read_changes(self.path, offset)
+                for event in events:
+                    if types is None or event.type in types:
+                        callback(event)
+            self.subscribers.append((callback, types))
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers = [(subscriber, types) for subscriber, types in self.subscribers
+                                if subscriber is not callback]
+
+    # Change listener: one event per (key, record) of the batch
+    def on_change(self, kind, changes, created=False):
+        header = SNAPSHOT_TABLES[kind][1]
+        to_row = ROW_WRITERS[kind]
+        created_type, updated_type, deleted_type = EVENT_TYPES[kind]
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+        with self.lock:
+            # The mutation is already saved, so a log that cannot be written only
+            # loses these events; the sequence moves on once they are logged
+            try:
+                if self.file is None and self.path is not None:
+                    self.file, self.sequence = open_log(self.path)
+                events = []
+                sequence = self.sequence
+                for key, record in changes:
+                    sequence += 1
+                    if record is None:
+                        events.append(ChangeEvent(sequence, deleted_type, kind, key, None, now))
+                    else:
+                        events.append(ChangeEvent(sequence, created_type if created else updated_type, kind, key,
+                                                  dict(zip(header, to_row(record))), now))
+                if self.file is not None:
+                    self.file.write(b''.join(json.dumps(event_to_json(event)).encode() + b'\n' for event in events))
+                    self.file.flush()
+                    if self.sync:
+                        os.fsync(self.file.fileno())
+            except OSError as error:
+                print(f"Could not log {len(changes)} change(s) to {kind}, "
+                      f"they are saved but not published: {error}")
+                self.close_log()
+                return
+            self.sequence = sequence
+            for callback, types in self.subscribers:
+                for event in events:
+                    if types is None or event.type in types:
+                        try:
+                            callback(event)
+                        except Exception as error:
+                            print(f"Change subscriber failed on event {event.sequence}: {error}")
+
+    def close(self):
+        if self.on_change in self.library.change_listeners:
+            self.library.change_listeners.remove(self.on_change)
+            self.library.journal_write_behind = self.journaled_before
+        with self.lock:
+            self.close_log()
+            self.subscribers = []
+
+    # Drop the log file after a failed write, its buffer with it; open_log cuts off
+    # any line left half-written when it is reopened
+    def close_log(self):
+        file, self.file = self.file, None
+        if file is not None:
+            try:
+                file.close()
+            except OSError:
+                pass
@@ -0,0 +1,133 @@
+import csv
+import io
+import locale
+import os
+
+# Journal record opcodes: an upsert carries the full CSV row, a delete only the key
+UPSERT = 'U'
+DELETE = 'D'
+
+# Append-only log of changes made to one .dat file since it was last rewritten.
+# Records are keyed by the first column of the row, so replaying the log over the
+# snapshot is idempotent: a crash between rewriting the .dat file and clearing the
+# log loses nothing.
+# With sync, every record is fsynced before append returns.
+# A crash during append can leave a partly written last record; replay skips it
+# and the next append or drop cuts it off.
+class Journal:
+    def __init__(self, path, sync=False):
+        self.path = path
+        self.sync = sync
+        self.file = None
+        self.count = 0  # records written since the last compaction
+        self.torn_at = None  # byte offset of a partly written last record
+
+    def __len__(self):
+        return self.count
+
+    def append(self, op, row):
+        if self.file is None:
+            self.cut_torn_record()
+            self.file = open(self.path, 'a', newline='')
+            self.writer = csv.writer(self.file)
+        self.writer.writerow([op] + row)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.count += 1
+
+    def upsert(self, row):
+        self.append(UPSERT, row)
+
+    def delete(self, key):
+        self.append(DELETE, [key])
+
+    # Apply the logged changes to records (a dict keyed by ID) in order, adding
+    # the affected keys to changed when it is given. A last record without its
+    # newline, or whose fields do not make a record, was cut short by a crash and
+    # is skipped; a bad record anywhere else is an error.
+    def replay(self, records, from_row, changed=None):
+        self.count = 0
+        self.torn_at = None
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return records
+        last, end = last_record(data)
+        if end < len(data):
+            self.torn_at = end
+        reader = csv.reader(io.StringIO(data[:end].decode(locale.getpreferredencoding(False)), newline=''))
+        for record in reader:
+            if not record:
+                continue
+            op, row = record[0], record[1:]
+            try:
+                if op == UPSERT:
+                    records[row[0]] = from_row(row)
+                elif op == DELETE:
+                    records.pop(row[0], None)
+            except (ValueError, IndexError):
+                if any(reader):
+                    raise
+                self.torn_at = last
+                break
+            if changed is not None:
+                changed.add(row[0])
+            self.count += 1
+        return records
+
+    # Drop a partly written last record found by replay
+    def cut_torn_record(self):
+        if self.torn_at is not None:
+            with open(self.path, 'r+b') as file:
+                file.truncate(self.torn_at)
+            self.torn_at = None
+
+    # Forget the first count records once they have been folded into the snapshot,
+    # keeping any appended since
+    def drop(self, count):
+        if count >= self.count:
+            self.clear()
+            return
+        self.close()
+        self.cut_torn_record()
+        with open(self.path, 'r', newline='') as file:
+            records = [record for record in csv.reader(file) if record][count:]
+        with open(self.path + '.tmp', 'w', newline='') as file:
+            csv.writer(file).writerows(records)
+            if self.sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(self.path + '.tmp', self.path)
+        self.count = len(records)
+
+    # Forget the logged changes once they have been folded into the snapshot
+    def clear(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.count = 0
+        self.torn_at = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# (start, end) byte offsets of the last complete record in journal data. A newline
+# ends a record only outside a quoted field, where the count of '"' before it is
+# even; anything after the last such newline was never finished.
+def last_record(data):
+    if b'"' not in data:
+        end = data.rfind(b'\n') + 1
+        return data.rfind(b'\n', 0, max(end - 1, 0)) + 1, end
+    start = end = position = quotes = 0
+    while True:
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            return start, end
+        quotes += data.count(b'"', position, newline)
+        position = newline + 1
+        if quotes % 2 == 0:
+            start, end = end, position
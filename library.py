@@ -2,6 +2,8 @@ import csv
 import datetime
 import os
 
+from search_index import TrigramIndex
+
 # Get the current directory of the script
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -40,12 +42,42 @@ class Member:
         self.borrowed_books = []
         self.reservations = []
 
+# Largest numeric key in an ID index (0 when empty or non-numeric)
+def max_id(index):
+    return max((int(key) for key in index if key.isdigit()), default=0)
+
 # Library manager class
 class LibraryManager:
     def __init__(self):
-        self.books = self.load_books()
-        self.reservations = self.load_reservations()
-        self.members = self.load_members()
+        # Primary-key indexes; dicts keep insertion order for the menus
+        self.books_by_id = {book.book_id: book for book in self.load_books()}
+        self.reservations_by_id = {reservation.reservation_id: reservation for reservation in self.load_reservations()}
+        self.members_by_id = {member.member_id: member for member in self.load_members()}
+
+        # Highest numeric ID seen per index, so new IDs never collide after deletes
+        self.last_book_id = max_id(self.books_by_id)
+        self.last_reservation_id = max_id(self.reservations_by_id)
+        self.last_member_id = max_id(self.members_by_id)
+
+        # Substring search indexes over book titles and member names
+        self.title_index = TrigramIndex()
+        for book in self.books:
+            self.title_index.add(book.book_id, book.title)
+        self.name_index = TrigramIndex()
+        for member in self.members:
+            self.name_index.add(member.member_id, member.name)
+
+    @property
+    def books(self):
+        return self.books_by_id.values()
+
+    @property
+    def reservations(self):
+        return self.reservations_by_id.values()
+
+    @property
+    def members(self):
+        return self.members_by_id.values()
 
     def load_books(self):
         books = []
@@ -54,6 +86,8 @@ class LibraryManager:
                 reader = csv.reader(f)
                 next(reader)  # Skip header row
                 for row in reader:
+                    if not row:
+                        continue  # Skip blank lines
                     book_id, title, author, isbn, available = row
                     book = Book(book_id, title, author, isbn, available == 'True')
                     books.append(book)
@@ -68,10 +102,12 @@ class LibraryManager:
                 reader = csv.reader(f)
                 next(reader)  # Skip header row
                 for row in reader:
-                    # Split the line into individual values
-                reservation_id, member_id, book_id, reservation_date = line.strip().split(',')
-                # Create a Reservation object and add it to the list
-                reservations.append(Reservation(reservation_id, member_id, book_id, reservation_date))
+                    if not row:
+                        continue  # Skip blank lines
+                    # Split the row into individual values
+                    reservation_id, member_id, book_id, reservation_date = row
+                    # Create a Reservation object and add it to the list
+                    reservations.append(Reservation(reservation_id, member_id, book_id, reservation_date))
         except FileNotFoundError:
             print(f"Error loading reservations: {RESERVATIONS_FILE} not found.")
         return reservations
@@ -83,6 +119,8 @@ class LibraryManager:
                 reader = csv.reader(f)
                 next(reader)  # Skip header row
                 for row in reader:
+                    if not row:
+                        continue  # Skip blank lines
                     member_id, name, contact = row
                     member = Member(member_id, name, contact)
                     members.append(member)
@@ -121,18 +159,22 @@ class LibraryManager:
             print(f"Error saving members: {MEMBERS_FILE}")
 
     def search_books(self, query):
-        results = [book for book in self.books if query.lower() in book.title.lower()]
+        results = [self.books_by_id[book_id] for book_id in self.title_index.search(query)]
+        return results
+
+    def search_members(self, query):
+        results = [self.members_by_id[member_id] for member_id in self.name_index.search(query)]
         return results
 
     def make_reservation(self, member_id, book_id):
-        member = next((m for m in self.members if m.member_id == member_id), None)
-        book = next((b for b in self.books if b.book_id == book_id), None)
+        member = self.members_by_id.get(member_id)
+        book = self.books_by_id.get(book_id)
 
         if member and book and not book.available:
-            reservation_id = len(self.reservations) + 1
+            self.last_reservation_id += 1
             reservation_date = datetime.date.today().isoformat()
-            reservation = Reservation(str(reservation_id), member_id, book_id, reservation_date)
-            self.reservations.append(reservation)
+            reservation = Reservation(str(self.last_reservation_id), member_id, book_id, reservation_date)
+            self.reservations_by_id[reservation.reservation_id] = reservation
             member.reservations.append(reservation)
             self.save_reservations()
             print(f"Reservation made for book '{book.title}' by {member.name}.")
@@ -157,11 +199,11 @@ class LibraryManager:
         summary += f"Unavailable books: {unavailable_books}\n"
         summary += "\nReservation queues:\n"
         for book_id, queue in book_queues.items():
-            book = next((b for b in self.books if b.book_id == book_id), None)
+            book = self.books_by_id.get(book_id)
             if book:
                 summary += f"{book.title} by {book.author}:\n"
                 for reservation in queue:
-                    member = next((m for m in self.members if m.member_id == reservation.member_id), None)
+                    member = self.members_by_id.get(reservation.member_id)
                     if member:
                         summary += f"  - {member.name} ({reservation.reservation_date})\n"
         return summary
@@ -178,7 +220,7 @@ class LibraryManager:
 
             if choice == '1':
                 name = input("Enter customer name: ")
-                customers = [m for m in self.members if name.lower() in m.name.lower()]
+                customers = self.search_members(name)
                 if customers:
                     print("\nCustomer search results:")
                     for customer in customers:
@@ -188,11 +230,12 @@ class LibraryManager:
 
             elif choice == '2':
                 member_id = input("Enter customer ID: ")
-                customer = next((m for m in self.members if m.member_id == member_id), None)
+                customer = self.members_by_id.get(member_id)
                 if customer:
                     new_name = input(f"Enter new name (current: {customer.name}): ")
                     new_contact = input(f"Enter new contact (current: {customer.contact}): ")
                     customer.name = new_name
+                    self.name_index.update(member_id, new_name)
                     customer.contact = new_contact
                     self.save_members()
                     print("Customer updated successfully.")
@@ -200,19 +243,21 @@ class LibraryManager:
                     print("Customer not found.")
 
             elif choice == '3':
-                member_id = str(len(self.members) + 1)
+                self.last_member_id += 1
+                member_id = str(self.last_member_id)
                 name = input("Enter customer name: ")
                 contact = input("Enter customer contact: ")
                 new_customer = Member(member_id, name, contact)
-                self.members.append(new_customer)
+                self.members_by_id[member_id] = new_customer
+                self.name_index.add(member_id, name)
                 self.save_members()
                 print("New customer created successfully.")
 
             elif choice == '4':
                 member_id = input("Enter customer ID to delete: ")
-                customer = next((m for m in self.members if m.member_id == member_id), None)
+                customer = self.members_by_id.pop(member_id, None)
                 if customer:
-                    self.members.remove(customer)
+                    self.name_index.remove(member_id)
                     self.save_members()
                     print("Customer deleted successfully.")
                 else:
@@ -236,7 +281,7 @@ class LibraryManager:
 
             if choice == '1':
                 title = input("Enter book title: ")
-                books = [b for b in self.books if title.lower() in b.title.lower()]
+                books = self.search_books(title)
                 if books:
                     print("\nBook search results:")
                     for book in books:
@@ -246,12 +291,13 @@ class LibraryManager:
 
             elif choice == '2':
                 book_id = input("Enter book ID: ")
-                book = next((b for b in self.books if b.book_id == book_id), None)
+                book = self.books_by_id.get(book_id)
                 if book:
                     new_title = input(f"Enter new title (current: {book.title}): ")
                     new_author = input(f"Enter new author (current: {book.author}): ")
                     new_available = input(f"Enter new availability (current: {book.available}): ")
                     book.title = new_title
+                    self.title_index.update(book_id, new_title)
                     book.author = new_author
                     book.available = new_available == 'True'
                     self.save_books()
@@ -260,21 +306,23 @@ class LibraryManager:
                     print("Book not found.")
 
             elif choice == '3':
-                book_id = str(len(self.books) + 1)
+                self.last_book_id += 1
+                book_id = str(self.last_book_id)
                 title = input("Enter book title: ")
                 author = input("Enter book author: ")
                 isbn = input("Enter book ISBN: ")
                 available = input("Is the book available? (True/False): ")
                 new_book = Book(book_id, title, author, isbn, available == 'True')
-                self.books.append(new_book)
+                self.books_by_id[book_id] = new_book
+                self.title_index.add(book_id, title)
                 self.save_books()
                 print("New book created successfully.")
 
             elif choice == '4':
                 book_id = input("Enter book ID to delete: ")
-                book = next((b for b in self.books if b.book_id == book_id), None)
+                book = self.books_by_id.pop(book_id, None)
                 if book:
-                    self.books.remove(book)
+                    self.title_index.remove(book_id)
                     self.save_books()
                     print("Book deleted successfully.")
                 else:
@@ -0,0 +1,176 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from benchmark import FIRST_WORDS, SECOND_WORDS, generate_dataset, percentile, table_sizes
+
+# Load generator for service.py: thousands of simulated customers, each on its own
+# keep-alive connection, issue a mix of searches, summaries, reservations, borrows
+# and returns for a fixed time. Reports requests/sec and latency percentiles per
+# request type as JSON.
+
+# Relative weights of the request types a customer picks from
+MIX = {'search': 60, 'summary': 5, 'reserve': 10, 'borrow': 15, 'return': 10}
+
+# Send one request on an open connection and read the response;
+# returns (status, decoded JSON body)
+async def request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: library\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length)) if length else None
+
+class Customer:
+    def __init__(self, number, books, seed):
+        self.rng = random.Random(seed + number)
+        self.sizes = table_sizes(books)
+        self.books = books
+        self.borrow_ids = []
+
+    # The next (kind, method, path, payload) this customer sends
+    def next_request(self):
+        rng = self.rng
+        kind = rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        if kind == 'return' and not self.borrow_ids:
+            kind = 'borrow'
+        member_id = str(rng.randint(1, self.sizes['members']))
+        on_loan = max(1, self.sizes['borrows'])
+
+        if kind == 'search':
+            query = rng.choice([rng.choice(SECOND_WORDS), f"{rng.choice(FIRST_WORDS)} {rng.choice(SECOND_WORDS)}"])
+            return kind, 'GET', '/books?q=' + query.replace(' ', '+'), None
+        if kind == 'summary':
+            return kind, 'GET', '/summary?limit=20', None
+        if kind == 'reserve':
+            return kind, 'POST', '/reservations', {'member_id': member_id, 'book_id': str(rng.randint(1, on_loan))}
+        if kind == 'borrow':
+            book_id = str(rng.randint(on_loan + 1, self.books)) if self.books > on_loan else '1'
+            return kind, 'POST', '/borrows', {'member_id': member_id, 'book_id': book_id}
+        borrow_id = self.borrow_ids.pop(rng.randrange(len(self.borrow_ids)))
+        return kind, 'POST', '/returns', {'borrow_id': borrow_id}
+
+    async def run(self, host, port, deadline, latencies, statuses, errors):
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as error:
+            errors[type(error).__name__] += 1
+            return
+        try:
+            while time.perf_counter() < deadline:
+                kind, method, path, payload = self.next_request()
+                start = time.perf_counter()
+                status, body = await request(reader, writer, method, path, payload)
+                latencies[kind].append(time.perf_counter() - start)
+                statuses[status] += 1
+                if kind == 'borrow' and status == 201:
+                    self.borrow_ids.append(body['borrow_id'])
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as error:
+            errors[type(error).__name__] += 1
+        finally:
+            writer.close()
+
+def stats(durations):
+    durations = sorted(durations)
+    if not durations:
+        return {'requests': 0}
+    return {
+        'requests': len(durations),
+        'mean_ms': 1000 * sum(durations) / len(durations),
+        'p50_ms': 1000 * percentile(durations, 0.50),
+        'p99_ms': 1000 * percentile(durations, 0.99),
+        'max_ms': 1000 * durations[-1],
+    }
+
+async def generate_load(host, port, customers, duration, books, seed):
+    latencies = {kind: [] for kind in MIX}
+    statuses = Counter()
+    errors = Counter()
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(
+        Customer(number, books, seed).run(host, port, deadline, latencies, statuses, errors)
+        for number in range(customers)
+    ))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(durations) for durations in latencies.values())
+    return {
+        'customers': customers,
+        'seconds': elapsed,
+        'requests': total,
+        'requests_per_second': total / elapsed,
+        'all': stats([duration for durations in latencies.values() for duration in durations]),
+        'by_type': {kind: stats(durations) for kind, durations in latencies.items()},
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': dict(errors),
+    }
+
+# Open and close one connection, raising OSError while nothing is listening
+async def probe(host, port):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 1)
+    writer.close()
+    await writer.wait_closed()
+
+# Start service.py on a generated data set and wait until it accepts connections
+def spawn_service(data_dir, host, port, books, journaled, seed):
+    generate_dataset(data_dir, books, seed)
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service.py'),
+               '--host', host, '--port', str(port), '--data-dir', data_dir]
+    if journaled:
+        command.append('--journaled')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    while True:
+        if process.poll() is not None:
+            raise SystemExit("service.py exited during startup")
+        try:
+            asyncio.run(probe(host, port))
+            return process
+        except (OSError, asyncio.TimeoutError):
+            time.sleep(0.1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the library HTTP service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--customers', type=int, default=2000, help="concurrent simulated customers")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to generate load for")
+    parser.add_argument('--books', type=int, default=10_000,
+                        help="catalog size the service was started with (IDs are drawn from it)")
+    parser.add_argument('--spawn', action='store_true',
+                        help="start service.py on a generated data set of --books books")
+    parser.add_argument('--journaled', action='store_true', help="start the spawned service in journaled mode")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        process = spawn_service(data_dir, args.host, args.port, args.books, args.journaled, args.seed) if args.spawn else None
+        try:
+            report = asyncio.run(generate_load(args.host, args.port, args.customers, args.duration, args.books, args.seed))
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGINT)
+                process.wait()
+    report['books'] = args.books
+    report['journaled'] = args.journaled if args.spawn else None
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+# Per-operation instrumentation: call counts, errors, cumulative time and a latency
+# histogram for every function wrapped with @instrumented. Recording is off unless
+# enabled (LIBRARY_METRICS=1 in the environment, or enable() at run time); while
+# off, a wrapped call costs one flag check.
+#
+# Histogram bucket i counts calls that took less than 2**i microseconds (and at
+# least half that), up to 2**(BUCKETS - 1) us, about 67 seconds; slower calls land
+# in the last bucket.
+
+BUCKETS = 27
+
+enabled = os.environ.get('LIBRARY_METRICS') == '1'
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+# Upper bound of histogram bucket i in seconds, None for the overflow bucket
+def bucket_bound(i):
+    return 2 ** i / 1e6 if i < BUCKETS - 1 else None
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def record(self, seconds, failed):
+        self.count += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    # Upper bound of the bucket holding the given fraction of calls (or the
+    # slowest call, if less), an estimate of that latency percentile that is at
+    # most twice the true value
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= fraction * self.count:
+                return min(bucket_bound(i) or self.max_seconds, self.max_seconds)
+        return self.max_seconds
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.total_seconds,
+            'mean_seconds': self.total_seconds / self.count if self.count else None,
+            'max_seconds': self.max_seconds,
+            'p50_seconds': self.percentile(0.50),
+            'p99_seconds': self.percentile(0.99),
+            'buckets': {('+Inf' if bucket_bound(i) is None else repr(bucket_bound(i))): count
+                        for i, count in enumerate(self.buckets) if count},
+        }
+
+# Operation name -> OperationStats, guarded by lock
+operations = {}
+lock = threading.Lock()
+
+def record(name, seconds, failed=False):
+    with lock:
+        stats = operations.get(name)
+        if stats is None:
+            stats = operations[name] = OperationStats()
+        stats.record(seconds, failed)
+
+# Decorator timing every call of function under its name
+def instrumented(function):
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(name, time.perf_counter() - start, failed)
+    return wrapper
+
+def reset():
+    with lock:
+        operations.clear()
+
+# {operation: stats dict}, in name order
+def snapshot():
+    with lock:
+        return {name: operations[name].to_dict() for name in sorted(operations)}
+
+def to_json():
+    return json.dumps({'enabled': enabled, 'operations': snapshot()}, indent=2)
+
+# Prometheus text exposition: one histogram (with cumulative buckets) and one
+# error counter, labelled by operation
+def to_prometheus():
+    with lock:
+        items = [(name, operations[name]) for name in sorted(operations)]
+        lines = ["# HELP library_operation_seconds Latency of LibraryManager operations.",
+                 "# TYPE library_operation_seconds histogram"]
+        for name, stats in items:
+            cumulative = 0
+            for i, count in enumerate(stats.buckets):
+                cumulative += count
+                bound = bucket_bound(i)
+                le = '+Inf' if bound is None else repr(bound)
+                lines.append(f'library_operation_seconds_bucket{{operation="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'library_operation_seconds_sum{{operation="{name}"}} {stats.total_seconds!r}')
+            lines.append(f'library_operation_seconds_count{{operation="{name}"}} {stats.count}')
+        lines += ["# HELP library_operation_errors_total Operations that raised an exception.",
+                  "# TYPE library_operation_errors_total counter"]
+        for name, stats in items:
+            lines.append(f'library_operation_errors_total{{operation="{name}"}} {stats.errors}')
+    return '\n'.join(lines) + '\n'
+
+# Write the metrics to path, as Prometheus text for a .prom or .txt file and as
+# JSON otherwise. The file is replaced atomically so a scraper never reads half of it.
+def write_metrics(path):
+    text = to_prometheus() if path.endswith(('.prom', '.txt')) else to_json()
+    with open(path + '.tmp', 'w') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+
+# Lines of the table shown by the staff Diagnostics option
+def report_lines():
+    stats = snapshot()
+    yield f"Instrumentation is {'on' if enabled else 'off'}.\n"
+    if not stats:
+        yield "No operations recorded.\n"
+        return
+    yield f"{'Operation':<22}{'Calls':>8}{'Errors':>8}{'Total ms':>12}{'Mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'Max ms':>10}\n"
+    for name, entry in stats.items():
+        yield (f"{name:<22}{entry['count']:>8}{entry['errors']:>8}{1000 * entry['total_seconds']:>12.2f}"
+               f"{1000 * entry['mean_seconds']:>10.3f}{1000 * entry['p50_seconds']:>10.3f}"
+               f"{1000 * entry['p99_seconds']:>10.3f}{1000 * entry['max_seconds']:>10.3f}\n")
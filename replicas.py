@@ -0,0 +1,288 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+# Read replicas: one writer process owns the LibraryManager and publishes the book
+# catalog as a memory-mapped file that any number of worker processes search
+# in place, so reads scale with cores and no worker parses books.dat.
+#
+# A catalog generation is one file laid out as
+#   HEADER (padded to HEADER_SIZE bytes)
+#   display_offsets  uint64 * (count + 1)   line starts in the display blob
+#   search_offsets   uint64 * (count + 1)   line starts in the search blob
+#   id_order         uint64 * count         book positions sorted by book ID
+#   availability     uint8 * count          1 when the book is on the shelf
+#   display blob     "book_id US title US author US isbn LF" per book, UTF-8
+#   search blob      lowercased title LF per book, UTF-8
+# Books keep the manager's insertion order, so results match search_books.
+# Borrows and returns flip availability bytes in place; creating, editing or
+# deleting a book publishes a new generation and points the control file at it.
+
+MAGIC = b'LIBCAT\0\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQ')  # magic, version, unused, generation, count, display and search sizes
+HEADER_SIZE = 64
+CONTROL = struct.Struct('<Q')  # current generation
+FIELD_SEPARATOR = '\x1f'
+
+# Generations kept on disk besides the current one, for readers still switching over
+RETAINED_GENERATIONS = 1
+
+# Fields of the book tuples returned by searches
+BOOK_FIELDS = ('book_id', 'title', 'author', 'isbn', 'available')
+
+def default_catalog_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f"library-catalog-{os.getpid()}")
+
+def display_line(book):
+    return FIELD_SEPARATOR.join((book.book_id, book.title, book.author, book.isbn)) + '\n'
+
+# Byte offsets of the sections of a catalog file with count books
+def section_offsets(count, display_size):
+    display_offsets = HEADER_SIZE
+    search_offsets = display_offsets + 8 * (count + 1)
+    id_order = search_offsets + 8 * (count + 1)
+    availability = id_order + 8 * count
+    display = availability + count
+    search = display + display_size
+    return display_offsets, search_offsets, id_order, availability, display, search
+
+# One catalog generation as bytes, built from books in order
+def build_catalog(books, generation):
+    display_lines = [display_line(book).encode() for book in books]
+    search_lines = [(book.title.lower() + '\n').encode() for book in books]
+    count = len(books)
+    ids = [book.book_id for book in books]
+    display_offsets = array('Q', accumulate(map(len, display_lines), initial=0))
+    search_offsets = array('Q', accumulate(map(len, search_lines), initial=0))
+    id_order = array('Q', sorted(range(count), key=ids.__getitem__))
+    header = HEADER.pack(MAGIC, VERSION, 0, generation, count, display_offsets[-1], search_offsets[-1])
+    return b''.join([
+        header.ljust(HEADER_SIZE, b'\0'),
+        display_offsets.tobytes(),
+        search_offsets.tobytes(),
+        id_order.tobytes(),
+        bytes(bool(book.available) for book in books),
+        b''.join(display_lines),
+        b''.join(search_lines),
+    ])
+
+# Writer side: keeps the published catalog in step with a LibraryManager
+class CatalogPublisher:
+    def __init__(self, library, path=None):
+        self.library = library
+        self.path = path or default_catalog_path()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.catalog = None     # writable map of the current generation
+        self.positions = {}     # book_id -> position in the current generation
+        self.live_files = []
+
+        with open(self.path + '.control', 'wb') as file:
+            file.write(CONTROL.pack(0))
+        control_file = open(self.path + '.control', 'r+b')
+        self.control = mmap.mmap(control_file.fileno(), CONTROL.size)
+        control_file.close()
+
+        with self.lock:
+            self.publish()
+        library.change_listeners.append(self.on_change)
+
+    def generation_file(self, generation):
+        return f"{self.path}.{generation}"
+
+    # Write a new generation from the manager's books and switch readers to it.
+    # Called with self.lock held.
+    def publish(self):
+        with self.library.lock:
+            books = list(self.library.books)
+        self.generation += 1
+        path = self.generation_file(self.generation)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(build_catalog(books, self.generation))
+        os.replace(path + '.tmp', path)
+
+        if self.catalog is not None:
+            self.catalog.close()
+        with open(path, 'r+b') as file:
+            self.catalog = mmap.mmap(file.fileno(), 0)
+        self.positions = {book.book_id: position for position, book in enumerate(books)}
+        header = HEADER.unpack_from(self.catalog)
+        self.sections = section_offsets(header[4], header[5])
+        CONTROL.pack_into(self.control, 0, self.generation)
+
+        # Readers map files, so unlinking an old generation never disturbs one in use
+        self.live_files.append(path)
+        while len(self.live_files) > RETAINED_GENERATIONS + 1:
+            os.remove(self.live_files.pop(0))
+
+    def published_line(self, position):
+        display_offsets, display = self.sections[0], self.sections[4]
+        start, end = struct.unpack_from('<QQ', self.catalog, display_offsets + 8 * position)
+        return self.catalog[display + start:display + end].decode()
+
+    # Change listener: availability is updated in place, anything else that changes
+    # what a search shows publishes a new generation
+    def on_change(self, kind, changes, created=False):
+        if kind != 'books':
+            return
+        with self.lock:
+            updates = []
+            for book_id, book in changes:
+                position = self.positions.get(book_id)
+                if book is None or position is None or self.published_line(position) != display_line(book):
+                    self.publish()
+                    return
+                updates.append((position, book.available))
+            availability = self.sections[3]
+            for position, available in updates:
+                self.catalog[availability + position] = 1 if available else 0
+
+    def close(self):
+        if self.on_change in self.library.change_listeners:
+            self.library.change_listeners.remove(self.on_change)
+        with self.lock:
+            self.catalog.close()
+            self.control.close()
+            for path in self.live_files + [self.path + '.control']:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.live_files = []
+
+# Reader side: searches whichever generation the control file points at
+class CatalogReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.control', 'rb') as file:
+            self.control = mmap.mmap(file.fileno(), CONTROL.size, access=mmap.ACCESS_READ)
+        self.generation = None
+        self.catalog = None
+        self.refresh()
+
+    # Map the current generation if the writer has published a newer one
+    def refresh(self):
+        while True:
+            generation = CONTROL.unpack_from(self.control)[0]
+            if generation == self.generation:
+                return
+            try:
+                with open(f"{self.path}.{generation}", 'rb') as file:
+                    catalog = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                continue  # already retired; the control file names a newer one
+            self.close_catalog()
+            self.catalog = catalog
+            self.generation = generation
+            magic, version, _, _, self.count, display_size, _ = HEADER.unpack_from(catalog)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{self.path}.{generation} is not a version {VERSION} catalog")
+            (display_offsets, search_offsets, id_order,
+             self.availability, self.display, self.search_start) = section_offsets(self.count, display_size)
+            self.view = memoryview(catalog)
+            self.display_offsets = self.view[display_offsets:search_offsets].cast('Q')
+            self.search_offsets = self.view[search_offsets:id_order].cast('Q')
+            self.id_order = self.view[id_order:self.availability].cast('Q')
+
+    def close_catalog(self):
+        if self.catalog is not None:
+            # The views must go before the map can close
+            for view in (self.display_offsets, self.search_offsets, self.id_order, self.view):
+                view.release()
+            self.catalog.close()
+            self.catalog = None
+
+    def close(self):
+        self.close_catalog()
+        self.control.close()
+
+    def book_at(self, position):
+        start = self.display + self.display_offsets[position]
+        end = self.display + self.display_offsets[position + 1] - 1
+        book_id, title, author, isbn = self.catalog[start:end].decode().split(FIELD_SEPARATOR)
+        return (book_id, title, author, isbn, self.catalog[self.availability + position] == 1)
+
+    def book_id_at(self, position):
+        start = self.display + self.display_offsets[position]
+        end = self.catalog.find(FIELD_SEPARATOR.encode(), start)
+        return self.catalog[start:end].decode()
+
+    # Positions of the books whose title contains query, in catalog order
+    def matches(self, query):
+        needle = query.lower().encode()
+        if not needle:
+            yield from range(self.count)
+            return
+        start = self.search_start
+        end = start + self.search_offsets[self.count]
+        found = self.catalog.find(needle, start, end)
+        while found != -1:
+            position = bisect_right(self.search_offsets, found - start) - 1
+            yield position
+            found = self.catalog.find(needle, start + self.search_offsets[position + 1], end)
+
+    # (number of matches, book tuples for matches start..start + limit)
+    def search_books(self, query, start=0, limit=None):
+        self.refresh()
+        total = 0
+        page = []
+        for position in self.matches(query):
+            if total >= start and (limit is None or len(page) < limit):
+                page.append(self.book_at(position))
+            total += 1
+        return total, page
+
+    # True or False for a book on record, None for an unknown ID
+    def is_available(self, book_id):
+        self.refresh()
+        index = bisect_left(range(self.count), book_id, key=lambda k: self.book_id_at(self.id_order[k]))
+        if index == self.count:
+            return None
+        position = self.id_order[index]
+        if self.book_id_at(position) != book_id:
+            return None
+        return self.catalog[self.availability + position] == 1
+
+# The reader of the worker process this runs in
+reader = None
+
+def attach(path):
+    global reader
+    reader = CatalogReader(path)
+
+def replica_search(query, start=0, limit=None):
+    return reader.search_books(query, start, limit)
+
+def replica_available(book_id):
+    return reader.is_available(book_id)
+
+def replica_count_many(queries):
+    return [reader.search_books(query, 0, 0)[0] for query in queries]
+
+# Worker processes answering reads from a publisher's catalog
+class ReplicaPool:
+    def __init__(self, path, workers=None):
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=attach, initargs=(path,))
+
+    def submit_search(self, query, start=0, limit=None):
+        return self.executor.submit(replica_search, query, start, limit)
+
+    def search_books(self, query, start=0, limit=None):
+        return self.submit_search(query, start, limit).result()
+
+    def is_available(self, book_id):
+        return self.executor.submit(replica_available, book_id).result()
+
+    # Match counts for many queries, shipped to the workers in chunks
+    def count_many(self, queries, chunk_size=64):
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        return [total for totals in self.executor.map(replica_count_many, chunks) for total in totals]
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,558 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import compress, islice
+
+# Length of the n-grams used as index terms
+GRAM_SIZE = 3
+
+# Distinct n-grams of an already lowercased string
+def grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+# Inverted trigram index giving case-insensitive substring search
+class TrigramIndex:
+    def __init__(self):
+        self.texts = {}     # key -> lowercased text
+        self.order = {}     # key -> insertion sequence, to return results in a stable order
+        self.postings = {}  # trigram -> set of keys containing it
+        self.next_seq = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        if key in self.texts:
+            self.update(key, text)
+            return
+        text = text.lower()
+        self.texts[key] = text
+        self.order[key] = self.next_seq
+        self.next_seq += 1
+        for gram in grams(text):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def update(self, key, text):
+        old_text = self.texts.get(key)
+        if old_text is None:
+            self.add(key, text)
+            return
+        text = text.lower()
+        old_grams = grams(old_text)
+        new_grams = grams(text)
+        for gram in old_grams - new_grams:
+            self._discard(gram, key)
+        for gram in new_grams - old_grams:
+            self.postings.setdefault(gram, set()).add(key)
+        self.texts[key] = text
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        del self.order[key]
+        for gram in grams(text):
+            self._discard(gram, key)
+
+    def _discard(self, gram, key):
+        keys = self.postings.get(gram)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    # Keys whose text contains query, in insertion order
+    def search(self, query):
+        query = query.lower()
+        if len(query) < GRAM_SIZE:
+            # Too short to use the index; such queries match most of the catalog anyway
+            return [key for key, text in self.texts.items() if query in text]
+
+        postings = []
+        for gram in grams(query):
+            keys = self.postings.get(gram)
+            if not keys:
+                return []
+            postings.append(keys)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            candidates &= keys
+            if not candidates:
+                return []
+
+        # Every trigram matching does not guarantee the substring does, so verify
+        results = [key for key in candidates if query in self.texts[key]]
+        results.sort(key=self.order.__getitem__)
+        return results
+
+    # Upper bound on the number of keys search(query) can return, from the posting sizes
+    def estimate(self, query):
+        query = query.lower()
+        if len(query) < GRAM_SIZE:
+            return len(self.texts)
+        return min(len(self.postings.get(gram, ())) for gram in grams(query))
+
+# Lowercased words of a name: "F. Scott Fitzgerald" -> ['f', 'scott', 'fitzgerald']
+def tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+# Word index over names giving token and token-prefix search: "fitz" and
+# "scott fitzgerald" both find "F. Scott Fitzgerald". A sorted vocabulary turns a
+# prefix into a contiguous range of tokens found with bisect.
+class TokenIndex:
+    def __init__(self):
+        self.texts = {}       # key -> tuple of its distinct tokens
+        self.order = {}       # key -> insertion sequence
+        self.postings = {}    # token -> set of keys
+        self.vocabulary = []  # sorted tokens with at least one key
+        self.next_seq = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        if key in self.texts:
+            self.update(key, text)
+            return
+        self.texts[key] = tuple(dict.fromkeys(tokens(text)))
+        self.order[key] = self.next_seq
+        self.next_seq += 1
+        for token in self.texts[key]:
+            self._insert(token, key)
+
+    def update(self, key, text):
+        old_tokens = self.texts.get(key)
+        if old_tokens is None:
+            self.add(key, text)
+            return
+        new_tokens = tuple(dict.fromkeys(tokens(text)))
+        for token in set(old_tokens) - set(new_tokens):
+            self._discard(token, key)
+        for token in set(new_tokens) - set(old_tokens):
+            self._insert(token, key)
+        self.texts[key] = new_tokens
+
+    def remove(self, key):
+        old_tokens = self.texts.pop(key, None)
+        if old_tokens is None:
+            return
+        del self.order[key]
+        for token in old_tokens:
+            self._discard(token, key)
+
+    def _insert(self, token, key):
+        keys = self.postings.get(token)
+        if keys is None:
+            keys = self.postings[token] = set()
+            self._add_word(token)
+        keys.add(key)
+
+    def _discard(self, token, key):
+        keys = self.postings.get(token)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.postings[token]
+                self._drop_word(token)
+
+    # Called when a token gains its first key and loses its last one
+    def _add_word(self, token):
+        insort(self.vocabulary, token)
+
+    def _drop_word(self, token):
+        del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    # Vocabulary tokens starting with prefix
+    def expand(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + '\U0010ffff', start)
+        return self.vocabulary[start:end]
+
+    def _matching(self, word, prefix):
+        if prefix:
+            return self.expand(word)
+        return [word] if word in self.postings else []
+
+    def estimate(self, query, prefix=True):
+        words = tokens(query)
+        if not words:
+            return len(self.texts)
+        return min(sum(len(self.postings[token]) for token in self._matching(word, prefix)) for word in words)
+
+    # Keys having, for every word of query, a token equal to it (or starting with
+    # it when prefix is true), in insertion order
+    def search(self, query, prefix=True):
+        words = tokens(query)
+        if not words:
+            return list(self.texts)
+        matches = []
+        for word in words:
+            keys = set()
+            for token in self._matching(word, prefix):
+                keys |= self.postings[token]
+            if not keys:
+                return []
+            matches.append(keys)
+        matches.sort(key=len)
+        results = matches[0].intersection(*matches[1:])
+        return sorted(results, key=self.order.__getitem__)
+
+    # Whether the text indexed under key matches query as search() would
+    def matches(self, key, query, prefix=True):
+        key_tokens = self.texts.get(key, ())
+        if prefix:
+            return all(any(token.startswith(word) for token in key_tokens) for word in tokens(query))
+        return all(word in key_tokens for word in tokens(query))
+
+# Canonical form of an ISBN: hyphens and spaces dropped, and ISBN-10 converted to
+# its ISBN-13 (978 prefix, recomputed check digit), so both forms of a book match.
+# Anything else is kept otherwise as written, uppercased, so it can still be found exactly.
+def normalize_isbn(isbn):
+    compact = isbn.replace('-', '').replace(' ', '').upper()
+    if len(compact) == 10 and compact[:9].isdigit() and (compact[9].isdigit() or compact[9] == 'X'):
+        core = '978' + compact[:9]
+        weighted = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(core))
+        return core + str(-weighted % 10)
+    return compact
+
+# Exact-match hash index from normalized ISBN to keys; several copies of one
+# edition share an ISBN
+class ISBNIndex:
+    def __init__(self):
+        self.texts = {}    # key -> normalized ISBN
+        self.entries = {}  # normalized ISBN -> {key: None}, in insertion order
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, isbn):
+        if key in self.texts:
+            self.update(key, isbn)
+            return
+        normalized = self.texts[key] = normalize_isbn(isbn)
+        self.entries.setdefault(normalized, {})[key] = None
+
+    def update(self, key, isbn):
+        if normalize_isbn(isbn) != self.texts.get(key):
+            self.remove(key)
+            self.add(key, isbn)
+
+    def remove(self, key):
+        normalized = self.texts.pop(key, None)
+        if normalized is None:
+            return
+        keys = self.entries[normalized]
+        del keys[key]
+        if not keys:
+            del self.entries[normalized]
+
+    def estimate(self, isbn):
+        return len(self.entries.get(normalize_isbn(isbn), ()))
+
+    def search(self, isbn):
+        return list(self.entries.get(normalize_isbn(isbn), ()))
+
+    def matches(self, key, isbn):
+        return self.texts.get(key) == normalize_isbn(isbn)
+
+# Trigrams of a word padded with '$' at both ends, so its first and last letters
+# count as much as the middle ones
+def word_grams(word):
+    return grams('$' + word + '$')
+
+# Words spelling correction applies to: numbers and codes only match exactly
+def fuzzy_word(token):
+    return token.isalpha()
+
+# Fuzzy title search. On top of the word postings of TokenIndex it keeps a trigram
+# index over the vocabulary, so a misspelled query word is matched to the indexed
+# words that share most of its trigrams (Jaccard similarity), and titles are ranked
+# by how well they match every query word.
+class FuzzyIndex(TokenIndex):
+    # Vocabulary trigrams in more words than this are skipped when correcting a
+    # word (unless too few rarer ones remain), bounding the work per query word
+    GRAM_CAP = 2000
+    # Keys taken from any one posting when collecting candidates
+    POSTING_CAP = 5000
+    # Corrections kept per query word, and the least similarity accepted
+    CORRECTIONS = 5
+    MIN_SIMILARITY = 0.35
+
+    def __init__(self):
+        super().__init__()
+        self.gram_words = {}  # padded trigram -> set of vocabulary words
+
+    # The trigram index replaces the sorted vocabulary, which would cost a list
+    # insertion per new word, so words only match whole (prefix=False)
+    def _add_word(self, token):
+        if fuzzy_word(token):
+            for gram in word_grams(token):
+                self.gram_words.setdefault(gram, set()).add(token)
+
+    def _drop_word(self, token):
+        if fuzzy_word(token):
+            for gram in word_grams(token):
+                words = self.gram_words.get(gram)
+                if words is not None:
+                    words.discard(token)
+                    if not words:
+                        del self.gram_words[gram]
+
+    # Up to CORRECTIONS (similarity, vocabulary word) pairs for word, best first
+    def corrections(self, word):
+        if word in self.postings:
+            return [(1.0, word)]
+        query_grams = word_grams(word)
+        postings = sorted((self.gram_words.get(gram, ()) for gram in query_grams), key=len)
+        usable = [words for words in postings if len(words) <= self.GRAM_CAP] or postings[:2]
+        shared = {}
+        for words in usable:
+            for candidate in words:
+                shared[candidate] = shared.get(candidate, 0) + 1
+        scored = []
+        for candidate, count in shared.items():
+            similarity = count / (len(query_grams) + len(word_grams(candidate)) - count)
+            if similarity >= self.MIN_SIMILARITY:
+                scored.append((similarity, candidate))
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:self.CORRECTIONS]
+
+    # Up to k (key, score) pairs ranked by score: the mean over query words of the
+    # best similarity of a word in the text, 1.0 for an exact word. Ties go to the
+    # text with fewer other words, then to insertion order.
+    #
+    # Candidates come from the postings of the corrections, rarest first, and
+    # enumeration stops once k texts score at least as well as any text outside
+    # the postings read so far could. A posting longer than POSTING_CAP adds only
+    # that many of its keys, so common words cost the same at any catalog size.
+    def fuzzy_search(self, query, k=10):
+        words = list(dict.fromkeys(tokens(query)))
+        corrections = [self.corrections(word) for word in words]
+        options = sorted(((len(self.postings[token]), number, similarity, token)
+                          for number, options in enumerate(corrections)
+                          for similarity, token in options))
+        if not options or k <= 0:
+            return []
+
+        remaining = [[similarity for similarity, _ in options] for options in corrections]
+        scored = {}
+        best = []  # heap of the k best (score, -length, -order) seen
+        for _, number, similarity, token in options:
+            for key in islice(self.postings[token], self.POSTING_CAP):
+                if key in scored:
+                    continue
+                total = 0.0
+                for word_options in corrections:
+                    for word_similarity, word_token in word_options:
+                        if key in self.postings[word_token]:
+                            total += word_similarity
+                            break
+                rank = (total, -len(self.texts[key]), -self.order[key])
+                scored[key] = rank
+                if len(best) < k:
+                    heapq.heappush(best, rank)
+                elif rank > best[0]:
+                    heapq.heapreplace(best, rank)
+            # The best a text outside every posting read so far can score
+            remaining[number].remove(similarity)
+            bound = sum(max(similarities, default=0.0) for similarities in remaining)
+            if len(best) == k and best[0][0] >= bound:
+                break
+
+        ranked = heapq.nlargest(k, scored.items(), key=lambda item: item[1])
+        return [(key, rank[0] / len(words)) for key, rank in ranked]
+
+# Title autocomplete: the k highest-scored texts starting with a prefix, in time
+# that does not grow with the number of texts. Lowercased texts sit in an array
+# sorted by (text, key), so a prefix is a contiguous range found with bisect, and a
+# segment tree over the array holds at each node the position of its best entry
+# (highest score, ties to the earlier position); the best k of a range then come
+# off a heap in O((k + log n) log n).
+#
+# New texts wait in a small sorted buffer that is spliced into the array once it
+# fills; removed ones leave a tombstone (score -1) until the next merge. Scores
+# are non-negative integers, e.g. how many loans and reservations a book has.
+class PrefixIndex:
+    # Texts buffered before a merge, which bounds the buffer's share of a query
+    BUFFER_LIMIT = 1024
+
+    # entries: (key, text, score) triples
+    def __init__(self, entries=()):
+        self.key_texts = {}  # key -> lowercased text, for every key
+        self.buffered = {}   # key -> score, for keys in the buffer
+        self.buffer = []     # sorted (text, key) of the buffered keys
+        entries = sorted((text.lower(), key, score) for key, text, score in entries)
+        for text, key, _ in entries:
+            self.key_texts[key] = text
+        self.build([text for text, _, _ in entries], [key for _, key, _ in entries],
+                   array('q', [score for _, _, score in entries]))
+
+    def __len__(self):
+        return len(self.key_texts)
+
+    # Take parallel sorted texts, keys and scores as the array and build its tree
+    # a level at a time
+    def build(self, texts, keys, scores):
+        self.texts = texts
+        self.keys = keys
+        self.scores = scores
+        self.tombstones = 0
+        size = 1
+        while size < len(keys):
+            size *= 2
+        self.size = size
+        tree = self.tree = array('q', [-1]) * (2 * size)
+        tree[size:size + len(keys)] = array('q', range(len(keys)))
+        level = size // 2
+        while level:
+            tree[level:2 * level] = array('q', [
+                left if right < 0 or (left >= 0 and scores[left] >= scores[right]) else right
+                for left, right in zip(tree[2 * level:4 * level:2], tree[2 * level + 1:4 * level:2])])
+            level //= 2
+
+    # Array position of a key not in the buffer: keys are sorted within a run of
+    # equal texts, and a tombstone left by the same key sorts just before it
+    def position(self, key):
+        text = self.key_texts[key]
+        start = bisect_left(self.texts, text)
+        end = bisect_right(self.texts, text, start)
+        position = bisect_left(self.keys, key, start, end)
+        while self.scores[position] < 0:
+            position += 1
+        return position
+
+    # Recompute a node's best position from its children
+    def pull(self, node):
+        tree = self.tree
+        left = tree[2 * node]
+        right = tree[2 * node + 1]
+        if right >= 0 and (left < 0 or self.scores[right] > self.scores[left]):
+            left = right
+        tree[node] = left
+
+    def set_slot(self, position, score):
+        self.scores[position] = score
+        node = (position + self.size) // 2
+        while node:
+            self.pull(node)
+            node //= 2
+
+    # Splice the buffer into the sorted array, dropping tombstones. Only list and
+    # array slices run per entry, so this is far cheaper than sorting again.
+    def merge(self):
+        live = [score >= 0 for score in self.scores]
+        old_texts = list(compress(self.texts, live))
+        old_keys = list(compress(self.keys, live))
+        old_scores = array('q', compress(self.scores, live))
+        texts, keys, scores = [], [], array('q')
+        start = 0
+        for text, key in self.buffer:
+            cut = bisect_left(old_texts, text, start)
+            while cut < len(old_texts) and old_texts[cut] == text and old_keys[cut] < key:
+                cut += 1
+            texts += old_texts[start:cut]
+            keys += old_keys[start:cut]
+            scores += old_scores[start:cut]
+            texts.append(text)
+            keys.append(key)
+            scores.append(self.buffered[key])
+            start = cut
+        texts += old_texts[start:]
+        keys += old_keys[start:]
+        scores += old_scores[start:]
+        self.buffered = {}
+        self.buffer = []
+        self.build(texts, keys, scores)
+
+    def add(self, key, text, score=0):
+        if key in self.key_texts:
+            self.update(key, text)
+            return
+        text = self.key_texts[key] = text.lower()
+        self.buffered[key] = score
+        insort(self.buffer, (text, key))
+        if len(self.buffer) > self.BUFFER_LIMIT:
+            self.merge()
+
+    def update(self, key, text):
+        old_text = self.key_texts.get(key)
+        if old_text is None:
+            self.add(key, text)
+        elif old_text != text.lower():
+            score = self.score(key)
+            self.remove(key)
+            self.add(key, text, score)
+
+    def remove(self, key):
+        if key not in self.key_texts:
+            return
+        if key in self.buffered:
+            del self.buffered[key]
+            self.buffer.pop(bisect_left(self.buffer, (self.key_texts.pop(key), key)))
+            return
+        self.set_slot(self.position(key), -1)
+        del self.key_texts[key]
+        self.tombstones += 1
+        if self.tombstones > max(self.BUFFER_LIMIT, len(self.key_texts)):
+            self.merge()
+
+    def score(self, key):
+        if key not in self.key_texts:
+            return None
+        if key in self.buffered:
+            return self.buffered[key]
+        return self.scores[self.position(key)]
+
+    def set_score(self, key, score):
+        if key not in self.key_texts:
+            return
+        if key in self.buffered:
+            self.buffered[key] = score
+            return
+        position = self.position(key)
+        if self.scores[position] != score:
+            self.set_slot(position, score)
+
+    # (-score, text, key) of the array entries in [start, end), best first
+    def ranked_range(self, start, end):
+        tree, scores, size = self.tree, self.scores, self.size
+        nodes = []
+        start += size
+        end += size
+        while start < end:
+            if start & 1:
+                nodes.append(start)
+                start += 1
+            if end & 1:
+                end -= 1
+                nodes.append(end)
+            start //= 2
+            end //= 2
+        heap = [(-scores[tree[node]], tree[node], node) for node in nodes if tree[node] >= 0]
+        heapq.heapify(heap)
+        while heap:
+            negated, position, node = heapq.heappop(heap)
+            if negated > 0:
+                return
+            if node >= size:
+                yield negated, self.texts[position], self.keys[position]
+                continue
+            for child in (2 * node, 2 * node + 1):
+                best = tree[child]
+                if best >= 0:
+                    heapq.heappush(heap, (-scores[best], best, child))
+
+    # Up to k (key, score) pairs whose text starts with prefix, highest score
+    # first, ties in text order
+    def complete(self, prefix, k=10):
+        if k <= 0:
+            return []
+        prefix = prefix.lower()
+        end = prefix + '\U0010ffff'
+        ranked = self.ranked_range(bisect_left(self.texts, prefix), bisect_left(self.texts, end))
+        matching = self.buffer[bisect_left(self.buffer, (prefix,)):bisect_left(self.buffer, (end,))]
+        buffered = heapq.nsmallest(k, ((-self.buffered[key], text, key) for text, key in matching))
+        return [(key, -negated) for negated, text, key in islice(heapq.merge(ranked, buffered), k)]
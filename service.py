@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from changefeed import ChangeFeed, event_to_json, read_changes
+from replicas import BOOK_FIELDS, CatalogPublisher, ReplicaPool
+from smart import DATA_FILES_DIR, DURABILITY_LEVELS, LibraryError, LibraryManager
+
+# Local HTTP/JSON front end serving many customers from one in-memory LibraryManager.
+#
+#   GET  /books?q=<query>[&start=&limit=]   matching books, a page at a time
+#   GET  /books?q=<query>&fuzzy=true[&limit=]   closest titles despite typos, with scores
+#   GET  /books?title=&author=&isbn=&available=true|false[&start=&limit=]
+#   GET  /autocomplete?prefix=<text>[&limit=]   titles starting with text, most requested first
+#   GET  /summary[?book_id=&author=&start=&limit=]
+#   POST /reservations  {"member_id", "book_id"}
+#   POST /borrows       {"member_id", "book_id"}
+#   POST /returns       {"borrow_id"}
+#   GET  /metrics       per-operation counts and latencies (with --metrics)
+#   GET  /changes?offset=<bytes>[&limit=]   change events logged from offset on, and
+#                       the offset to ask for next (with --change-log)
+#
+# Reads answer straight from memory on the event loop. Mutations write to disk, so
+# they run in a thread pool and the loop never blocks on I/O; the manager's own
+# locks keep concurrent mutations consistent. With replicas, searches go to worker
+# processes reading the shared catalog instead, so they use more than one core.
+
+MAX_BODY_SIZE = 64 * 1024
+
+# Books returned per search request unless the client asks for another limit
+SEARCH_PAGE_SIZE = 50
+
+# Titles suggested per autocomplete request unless the client asks for another limit
+AUTOCOMPLETE_SIZE = 10
+
+# Change events returned per request unless the client asks for another limit
+CHANGES_PAGE_SIZE = 1000
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+
+# Raised while handling a request to answer it with an error status
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def book_to_json(book):
+    return {'book_id': book.book_id, 'title': book.title, 'author': book.author,
+            'isbn': book.isbn, 'available': book.available}
+
+def borrow_to_json(borrow):
+    return {'borrow_id': borrow.borrow_id, 'member_id': borrow.member_id, 'book_id': borrow.book_id,
+            'borrow_date': borrow.borrow_date, 'due_date': borrow.due_date}
+
+def reservation_to_json(reservation):
+    return {'reservation_id': reservation.reservation_id, 'member_id': reservation.member_id,
+            'book_id': reservation.book_id, 'reservation_date': reservation.reservation_date,
+            'status': reservation.status, 'hold_expires': reservation.hold_expires}
+
+# String fields of a JSON request body, all required
+def required_fields(body, *names):
+    values = []
+    for name in names:
+        value = body.get(name)
+        if value is None or value == '':
+            raise HTTPError(400, f"Missing field '{name}'.")
+        values.append(str(value))
+    return values
+
+class LibraryService:
+    def __init__(self, library, workers=8, replicas=0, change_log=None):
+        self.library = library
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-io')
+        self.publisher = self.replicas = None
+        if replicas:
+            self.publisher = CatalogPublisher(library)
+            self.replicas = ReplicaPool(self.publisher.path, replicas)
+        self.feed = None
+        if change_log:
+            self.feed = ChangeFeed(library, change_log, sync=library.durability == 'op')
+        self.routes = {
+            ('GET', '/books'): self.search,
+            ('GET', '/autocomplete'): self.autocomplete,
+            ('GET', '/summary'): self.summary,
+            ('POST', '/reservations'): self.reserve,
+            ('POST', '/borrows'): self.borrow,
+            ('POST', '/returns'): self.give_back,
+            ('GET', '/metrics'): self.metrics,
+            ('GET', '/changes'): self.changes,
+        }
+
+    # Run a mutation in the thread pool, turning LibraryError into 409 Conflict
+    async def mutate(self, function, *args):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, partial(function, *args))
+        except LibraryError as error:
+            raise HTTPError(409, str(error))
+
+    async def search(self, query, body):
+        try:
+            start = int(query.get('start', 0))
+            limit = int(query.get('limit', SEARCH_PAGE_SIZE))
+        except ValueError:
+            raise HTTPError(400, "start and limit must be integers.")
+        if query.get('fuzzy') == 'true':
+            matches = self.library.fuzzy_search(query.get('q', ''), limit)
+            return 200, {'total': len(matches),
+                         'books': [dict(book_to_json(book), score=score) for book, score in matches]}
+        if any(field in query for field in ('title', 'author', 'isbn', 'available')):
+            available = query.get('available')
+            if available not in (None, 'true', 'false'):
+                raise HTTPError(400, "available must be true or false.")
+            books = self.library.find_books(query.get('title'), query.get('author'), query.get('isbn'),
+                                            None if available is None else available == 'true')
+            page = books[start:start + limit]
+            return 200, {'total': len(books), 'books': [book_to_json(book) for book in page]}
+        if self.replicas:
+            future = self.replicas.submit_search(query.get('q', ''), start, limit)
+            total, page = await asyncio.wrap_future(future)
+            return 200, {'total': total, 'books': [dict(zip(BOOK_FIELDS, book)) for book in page]}
+        books = self.library.search_books(query.get('q', ''))
+        page = books[start:start + limit]
+        return 200, {'total': len(books), 'books': [book_to_json(book) for book in page]}
+
+    async def autocomplete(self, query, body):
+        try:
+            limit = int(query.get('limit', AUTOCOMPLETE_SIZE))
+        except ValueError:
+            raise HTTPError(400, "limit must be an integer.")
+        matches = self.library.autocomplete(query.get('prefix', ''), limit)
+        return 200, {'books': [dict(book_to_json(book), rank=rank) for book, rank in matches]}
+
+    async def summary(self, query, body):
+        if not query:
+            return 200, {'summary': self.library.get_book_summary()}
+        try:
+            start = int(query.get('start', 0))
+            limit = int(query['limit']) if 'limit' in query else None
+        except ValueError:
+            raise HTTPError(400, "start and limit must be integers.")
+        lines = self.library.iter_book_summary(query.get('book_id'), query.get('author'), start, limit)
+        return 200, {'summary': ''.join(lines)}
+
+    async def reserve(self, query, body):
+        member_id, book_id = required_fields(body, 'member_id', 'book_id')
+        reservation = await self.mutate(self.library.reserve, member_id, book_id)
+        return 201, reservation_to_json(reservation)
+
+    async def borrow(self, query, body):
+        member_id, book_id = required_fields(body, 'member_id', 'book_id')
+        borrow = await self.mutate(self.library.borrow, member_id, book_id)
+        return 201, borrow_to_json(borrow)
+
+    async def give_back(self, query, body):
+        borrow_id, = required_fields(body, 'borrow_id')
+        borrow = await self.mutate(self.library.give_back, borrow_id)
+        return 200, borrow_to_json(borrow)
+
+    async def metrics(self, query, body):
+        return 200, {'enabled': metrics.enabled, 'operations': metrics.snapshot()}
+
+    # Reading the log is file I/O, so it runs in the thread pool
+    async def changes(self, query, body):
+        if self.feed is None:
+            raise HTTPError(404, "The change log is not enabled.")
+        try:
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', CHANGES_PAGE_SIZE))
+        except ValueError:
+            raise HTTPError(400, "offset and limit must be integers.")
+        if offset < 0:
+            raise HTTPError(400, "offset must not be negative.")
+        loop = asyncio.get_running_loop()
+        try:
+            events, next_offset = await loop.run_in_executor(self.executor, read_changes, self.feed.path, offset, limit)
+        except ValueError:
+            raise HTTPError(400, "offset is not the start of an event.")
+        return 200, {'events': [event_to_json(event) for event in events], 'next_offset': next_offset}
+
+    # One HTTP/1.1 connection; requests are answered in order until the client
+    # closes it or asks to
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self.handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line, reader, writer):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            self.respond(writer, 400, {'error': "Malformed request line."}, False)
+            return False
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+        try:
+            try:
+                length = int(headers.get('content-length', 0))
+            except ValueError:
+                keep_alive = False
+                raise HTTPError(400, "Invalid Content-Length.")
+            if length > MAX_BODY_SIZE:
+                keep_alive = False
+                raise HTTPError(413, "Request body too large.")
+            raw_body = await reader.readexactly(length) if length else b''
+            url = urlsplit(target)
+            handler = self.routes.get((method, url.path))
+            if handler is None:
+                if any(path == url.path for _, path in self.routes):
+                    raise HTTPError(405, f"{method} is not allowed on {url.path}.")
+                raise HTTPError(404, f"No route for {url.path}.")
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except ValueError:
+                raise HTTPError(400, "Body is not valid JSON.")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "Body must be a JSON object.")
+            status, payload = await handler(query, body)
+        except HTTPError as error:
+            status, payload = error.status, {'error': str(error)}
+        except Exception as error:
+            status, payload = 500, {'error': f"{type(error).__name__}: {error}"}
+
+        self.respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode()
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+        print(f"Library service listening on http://{host}:{port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    # Let queued mutations finish, then persist what is left
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.replicas:
+            self.replicas.close()
+            self.publisher.close()
+        self.library.close()
+        if self.feed:
+            self.feed.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON service over LibraryManager")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--data-dir', default=DATA_FILES_DIR)
+    parser.add_argument('--journaled', action='store_true', help="append changes to journals instead of rewriting .dat files")
+    parser.add_argument('--write-behind', action='store_true',
+                        help="let a background thread coalesce file rewrites instead of saving on every change")
+    parser.add_argument('--durability', choices=DURABILITY_LEVELS, default='none',
+                        help="when to fsync: never, on every file rewrite, or on every change")
+    parser.add_argument('--workers', type=int, default=min(32, (os.cpu_count() or 1) + 4),
+                        help="threads that run mutations and their disk writes")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="record operation latencies and write them to FILE on exit (.prom for Prometheus text)")
+    parser.add_argument('--replicas', type=int, default=0, help="worker processes answering searches (0 to search in-process)")
+    parser.add_argument('--change-log', metavar='FILE', help="append every change to FILE for downstream systems to tail")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+    library = LibraryManager(args.data_dir, journaled=args.journaled, write_behind=args.write_behind,
+                             durability=args.durability)
+    service = LibraryService(library, args.workers, args.replicas, args.change_log)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        if args.metrics:
+            metrics.write_metrics(args.metrics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import pickle
+import struct
+from operator import attrgetter
+
+# Binary snapshot of the loaded .dat files, read in preference to parsing the CSV.
+# Layout: MAGIC, a little-endian uint32 format version, then one protocol 5 pickle
+# holding the source file signatures and a list of columns per table (plus any
+# prebuilt structures the caller wants to keep, such as search indexes).
+MAGIC = b'LIBSNAP\0'
+VERSION = 4
+HEADER = struct.Struct('<8sI')
+
+# (mtime_ns, size) of a file, or None when it does not exist
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def source_signatures(paths):
+    return {os.path.basename(path): file_signature(path) for path in paths}
+
+# Write tables ({name: column lists or any other picklable value}) along with
+# the signatures of the files they were loaded from. The file is replaced atomically.
+def write_snapshot(path, source_paths, tables):
+    payload = {
+        'sources': source_signatures(source_paths),
+        'tables': tables,
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION))
+        pickle.dump(payload, file, protocol=5)
+    os.replace(temp_path, path)
+
+# Tables from the snapshot at path, or None if it is missing, from another format
+# version, or older than any of the source files
+def read_snapshot(path, source_paths):
+    try:
+        with open(path, 'rb') as file:
+            magic, version = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                return None
+            payload = pickle.load(file)
+    except (FileNotFoundError, struct.error, pickle.UnpicklingError, EOFError):
+        return None
+    if payload['sources'] != source_signatures(source_paths):
+        return None
+    return payload['tables']
+
+# Column lists for records, one per attribute name
+def to_columns(records, fields):
+    return [list(map(attrgetter(field), records)) for field in fields]
+
+# Records rebuilt from column lists by calling factory with one value per column
+def from_columns(factory, columns):
+    return list(map(factory, *columns))
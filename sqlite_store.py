@@ -0,0 +1,492 @@
+import datetime
+import os
+import sqlite3
+
+from metrics import instrumented
+from search_index import FuzzyIndex, PrefixIndex
+from smart import DATA_FILES_DIR, HOLD_DAYS, PENDING, READY, Book, Borrow, LibraryManager, Member, Reservation, day_number
+
+DATABASE_FILE_NAME = 'library.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    book_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    isbn TEXT NOT NULL,
+    available INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_title ON books (title);
+CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+CREATE INDEX IF NOT EXISTS books_available ON books (available);
+
+CREATE TABLE IF NOT EXISTS members (
+    member_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    contact TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS members_name ON members (name);
+
+CREATE TABLE IF NOT EXISTS borrows (
+    borrow_id TEXT PRIMARY KEY,
+    member_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    borrow_date TEXT NOT NULL,
+    due_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS borrows_member_id ON borrows (member_id);
+CREATE INDEX IF NOT EXISTS borrows_book_id ON borrows (book_id);
+CREATE INDEX IF NOT EXISTS borrows_due_date ON borrows (due_date);
+
+CREATE TABLE IF NOT EXISTS reservations (
+    reservation_id TEXT PRIMARY KEY,
+    member_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    reservation_date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    hold_expires TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS reservations_member_id ON reservations (member_id);
+CREATE INDEX IF NOT EXISTS reservations_book_id ON reservations (book_id, reservation_date, reservation_id);
+
+-- Last ID handed out per table, bumped in the same transaction as the insert
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+-- Trigram full-text indexes give substring search on titles and names
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, content='books', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+    INSERT INTO books_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS members_fts USING fts5(
+    name, content='members', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS members_fts_insert AFTER INSERT ON members BEGIN
+    INSERT INTO members_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS members_fts_delete AFTER DELETE ON members BEGIN
+    INSERT INTO members_fts (members_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS members_fts_update AFTER UPDATE OF name ON members BEGIN
+    INSERT INTO members_fts (members_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO members_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+"""
+
+# Statements are constant strings so sqlite3's statement cache prepares each one once
+SELECT_TITLES = "SELECT book_id, title FROM books ORDER BY rowid"
+# Titles with their autocomplete rank: open loans plus reservations
+SELECT_TITLE_DEMAND = """
+    SELECT book_id, title,
+           (SELECT COUNT(*) FROM borrows WHERE borrows.book_id = books.book_id)
+           + (SELECT COUNT(*) FROM reservations WHERE reservations.book_id = books.book_id)
+    FROM books
+"""
+SELECT_DEMAND = "SELECT (SELECT COUNT(*) FROM borrows WHERE book_id = ?) + (SELECT COUNT(*) FROM reservations WHERE book_id = ?)"
+SELECT_BOOK = "SELECT book_id, title, author, isbn, available FROM books WHERE book_id = ?"
+SELECT_MEMBER = "SELECT member_id, name, contact FROM members WHERE member_id = ?"
+SELECT_BORROW = "SELECT borrow_id, member_id, book_id, borrow_date, due_date FROM borrows WHERE borrow_id = ?"
+# ISO dates sort as text, so a due-date range is an index range scan
+SELECT_DUE_BETWEEN = """
+    SELECT borrow_id, member_id, book_id, borrow_date, due_date FROM borrows
+    WHERE due_date >= ? AND due_date < ?
+    ORDER BY due_date, CAST(borrow_id AS INTEGER), borrow_id
+"""
+SEARCH_BOOKS = """
+    SELECT book_id, title, author, isbn, available FROM books
+    WHERE rowid IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)
+    ORDER BY rowid
+"""
+SCAN_BOOKS = """
+    SELECT book_id, title, author, isbn, available FROM books
+    WHERE instr(lower(title), ?) > 0 ORDER BY rowid
+"""
+SEARCH_MEMBERS = """
+    SELECT member_id, name, contact FROM members
+    WHERE rowid IN (SELECT rowid FROM members_fts WHERE members_fts MATCH ?)
+    ORDER BY rowid
+"""
+SCAN_MEMBERS = """
+    SELECT member_id, name, contact FROM members
+    WHERE instr(lower(name), ?) > 0 ORDER BY rowid
+"""
+INSERT_BOOK = "INSERT INTO books (book_id, title, author, isbn, available) VALUES (?, ?, ?, ?, ?)"
+INSERT_MEMBER = "INSERT INTO members (member_id, name, contact) VALUES (?, ?, ?)"
+INSERT_BORROW = "INSERT INTO borrows (borrow_id, member_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?, ?)"
+INSERT_RESERVATION = """
+    INSERT INTO reservations (reservation_id, member_id, book_id, reservation_date, status, hold_expires)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+# A returned copy goes to the oldest pending reservation, in the order they were made
+NEXT_PENDING = """
+    SELECT reservation_id, member_id FROM reservations
+    WHERE book_id = ? AND status = ? ORDER BY rowid LIMIT 1
+"""
+HOLD_COPY = "UPDATE reservations SET status = ?, hold_expires = ? WHERE reservation_id = ?"
+COLLECT_HOLD = "DELETE FROM reservations WHERE book_id = ? AND member_id = ? AND status = ? RETURNING reservation_id"
+DELETE_RESERVATION = "DELETE FROM reservations WHERE reservation_id = ? RETURNING book_id, status"
+NEXT_ID = """
+    INSERT INTO sequences (name, value) VALUES (?, 1)
+    ON CONFLICT (name) DO UPDATE SET value = value + 1
+    RETURNING value
+"""
+SUMMARY_COUNTS = "SELECT (SELECT COUNT(*) FROM books), (SELECT COUNT(*) FROM books WHERE available = 1)"
+SUMMARY_QUEUES = """
+    SELECT b.book_id, b.title, b.author, m.name, r.reservation_date, r.status, r.hold_expires FROM (
+        SELECT rowid, book_id, member_id, reservation_date, status, hold_expires,
+               MIN(rowid) OVER (PARTITION BY book_id) AS first_rowid
+        FROM reservations
+    ) AS r
+    JOIN books AS b ON b.book_id = r.book_id
+    JOIN members AS m ON m.member_id = r.member_id
+    ORDER BY r.first_rowid, r.rowid
+"""
+
+# FTS5 phrase query matching text anywhere in the indexed column
+def fts_phrase(query):
+    return '"' + query.replace('"', '""') + '"'
+
+def book_from_record(record):
+    book_id, title, author, isbn, available = record
+    return Book(book_id, title, author, isbn, bool(available))
+
+# LibraryManager with the same public methods, backed by an SQLite database instead of
+# .dat files held in memory. Every operation is an indexed query touching only the
+# rows it changes.
+class SQLiteLibraryManager:
+    def __init__(self, database_file=os.path.join(DATA_FILES_DIR, DATABASE_FILE_NAME)):
+        self.database_file = database_file
+        self.connection = sqlite3.connect(database_file)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        # Databases made before holds existed lack the hold expiry column
+        columns = [column[1] for column in self.connection.execute("PRAGMA table_info(reservations)")]
+        if 'hold_expires' not in columns:
+            self.connection.execute("ALTER TABLE reservations ADD COLUMN hold_expires TEXT NOT NULL DEFAULT ''")
+        # Title words for fuzzy search, built from the table on first use
+        self.title_words_index = None
+        # Title autocomplete, likewise built on first use
+        self.title_prefix_index = None
+
+    def close(self):
+        self.connection.close()
+
+    def next_id(self, name):
+        return str(self.connection.execute(NEXT_ID, (name,)).fetchone()[0])
+
+    def get_book(self, book_id):
+        record = self.connection.execute(SELECT_BOOK, (book_id,)).fetchone()
+        return book_from_record(record) if record else None
+
+    def get_member(self, member_id):
+        record = self.connection.execute(SELECT_MEMBER, (member_id,)).fetchone()
+        return Member(*record) if record else None
+
+    def get_borrow(self, borrow_id):
+        record = self.connection.execute(SELECT_BORROW, (borrow_id,)).fetchone()
+        return Borrow(*record) if record else None
+
+    @instrumented
+    def search_books(self, query):
+        query = query.lower()
+        if len(query) < 3:
+            # The trigram index cannot serve shorter queries
+            records = self.connection.execute(SCAN_BOOKS, (query,))
+        else:
+            records = self.connection.execute(SEARCH_BOOKS, (fts_phrase(query),))
+        return [book_from_record(record) for record in records]
+
+    # Same as LibraryManager.fuzzy_search
+    @instrumented
+    def fuzzy_search(self, query, k=10):
+        if self.title_words_index is None:
+            self.title_words_index = FuzzyIndex()
+            for book_id, title in self.connection.execute(SELECT_TITLES):
+                self.title_words_index.add(book_id, title)
+        return [(self.get_book(book_id), score) for book_id, score in self.title_words_index.fuzzy_search(query, k)]
+
+    @instrumented
+    def autocomplete(self, prefix, k=10):
+        if self.title_prefix_index is None:
+            self.title_prefix_index = PrefixIndex(self.connection.execute(SELECT_TITLE_DEMAND))
+        return [(self.get_book(book_id), rank) for book_id, rank in self.title_prefix_index.complete(prefix, k)]
+
+    # Refresh a book's autocomplete rank after its loans or reservations change
+    def rerank(self, book_id):
+        if self.title_prefix_index is not None:
+            demand, = self.connection.execute(SELECT_DEMAND, (book_id, book_id)).fetchone()
+            self.title_prefix_index.set_score(book_id, demand)
+
+    def search_members(self, query):
+        query = query.lower()
+        if len(query) < 3:
+            records = self.connection.execute(SCAN_MEMBERS, (query,))
+        else:
+            records = self.connection.execute(SEARCH_MEMBERS, (fts_phrase(query),))
+        return [Member(*record) for record in records]
+
+    @instrumented
+    def make_reservation(self, member_id, book_id):
+        member = self.get_member(member_id)
+        book = self.get_book(book_id)
+
+        if member and book and not book.available:
+            with self.connection:
+                reservation_id = self.next_id('reservations')
+                reservation_date = datetime.date.today().isoformat()
+                reservation = Reservation(reservation_id, member_id, book_id, reservation_date)
+                self.connection.execute(INSERT_RESERVATION, (reservation_id, member_id, book_id, reservation_date,
+                                                             reservation.status, reservation.hold_expires))
+            self.rerank(book_id)
+            print(f"Reservation made for book '{book.title}' by {member.name}.")
+            return reservation
+        else:
+            print("Invalid member or book, or book is available.")
+
+    @instrumented
+    def get_book_summary(self):
+        return ''.join(self.iter_book_summary())
+
+    # Lines of the book summary streamed from the database cursor; the filters and
+    # paging match LibraryManager.iter_book_summary
+    def iter_book_summary(self, book_id=None, author=None, start=0, limit=None):
+        total_books, available_books = self.connection.execute(SUMMARY_COUNTS).fetchone()
+        unavailable_books = total_books - available_books
+
+        yield f"Total books: {total_books}\n"
+        yield f"Available books: {available_books}\n"
+        yield f"Unavailable books: {unavailable_books}\n"
+        yield "\nReservation queues:\n"
+
+        author = author.lower() if author else None
+        current_book_id = None
+        skipped = shown = 0
+        showing = False
+        for queue_book_id, title, book_author, name, reservation_date, status, hold_expires in self.connection.execute(SUMMARY_QUEUES):
+            if queue_book_id != current_book_id:
+                current_book_id = queue_book_id
+                showing = False
+                if (book_id is not None and queue_book_id != book_id) or (author and author not in book_author.lower()):
+                    continue
+                if skipped < start:
+                    skipped += 1
+                    continue
+                if limit is not None and shown >= limit:
+                    break
+                shown += 1
+                showing = True
+                yield f"{title} by {book_author}:\n"
+            if showing:
+                held = f", ready until {hold_expires}" if status == READY else ""
+                yield f"  - {name} ({reservation_date}{held})\n"
+
+    # Same as LibraryManager.overdue; a due date too malformed to compare is never overdue
+    def overdue(self, as_of=None):
+        limit = datetime.date.fromordinal(day_number(as_of)).isoformat()
+        borrows = [Borrow(*record) for record in self.connection.execute(SELECT_DUE_BETWEEN, ('0000', limit))]
+        return [borrow for borrow in borrows if borrow.due_ordinal is not None]
+
+    def due_within(self, days, as_of=None):
+        start = day_number(as_of)
+        bounds = (datetime.date.fromordinal(start).isoformat(), datetime.date.fromordinal(start + days + 1).isoformat())
+        return [Borrow(*record) for record in self.connection.execute(SELECT_DUE_BETWEEN, bounds)]
+
+    def create_book(self, title, author, isbn):
+        with self.connection:
+            book_id = self.next_id('books')
+            self.connection.execute(INSERT_BOOK, (book_id, title, author, isbn, 1))
+        if self.title_words_index is not None:
+            self.title_words_index.add(book_id, title)
+        if self.title_prefix_index is not None:
+            self.title_prefix_index.add(book_id, title)
+        print(f"Book '{title}' by {author} created successfully.")
+
+    def edit_book(self, book_id, new_title=None, new_author=None, new_isbn=None):
+        book = self.get_book(book_id)
+        if book:
+            book.title = new_title or book.title
+            book.author = new_author or book.author
+            book.isbn = new_isbn or book.isbn
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE books SET title = ?, author = ?, isbn = ? WHERE book_id = ?",
+                    (book.title, book.author, book.isbn, book_id),
+                )
+            if self.title_words_index is not None:
+                self.title_words_index.update(book_id, book.title)
+            if self.title_prefix_index is not None:
+                self.title_prefix_index.update(book_id, book.title)
+            print(f"Book '{book.title}' by {book.author} updated successfully.")
+        else:
+            print(f"Book with ID {book_id} not found.")
+
+    def delete_book(self, book_id):
+        book = self.get_book(book_id)
+        if book:
+            with self.connection:
+                self.connection.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
+            if self.title_words_index is not None:
+                self.title_words_index.remove(book_id)
+            if self.title_prefix_index is not None:
+                self.title_prefix_index.remove(book_id)
+            print(f"Book '{book.title}' by {book.author} deleted successfully.")
+        else:
+            print(f"Book with ID {book_id} not found.")
+
+    def create_member(self, name, contact):
+        with self.connection:
+            member_id = self.next_id('members')
+            self.connection.execute(INSERT_MEMBER, (member_id, name, contact))
+        print(f"Member '{name}' created successfully.")
+
+    def edit_member(self, member_id, new_name=None, new_contact=None):
+        member = self.get_member(member_id)
+        if member:
+            member.name = new_name or member.name
+            member.contact = new_contact or member.contact
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE members SET name = ?, contact = ? WHERE member_id = ?",
+                    (member.name, member.contact, member_id),
+                )
+            print(f"Member '{member.name}' updated successfully.")
+        else:
+            print(f"Member with ID {member_id} not found.")
+
+    def delete_member(self, member_id):
+        member = self.get_member(member_id)
+        if member:
+            with self.connection:
+                self.connection.execute("DELETE FROM members WHERE member_id = ?", (member_id,))
+            print(f"Member '{member.name}' deleted successfully.")
+        else:
+            print(f"Member with ID {member_id} not found.")
+
+    def create_reservation(self, member_id, book_id):
+        return self.make_reservation(member_id, book_id)
+
+    # Cancelling a ready reservation releases its copy to the next in line
+    def delete_reservation(self, reservation_id):
+        with self.connection:
+            deleted = self.connection.execute(DELETE_RESERVATION, (reservation_id,)).fetchall()
+            if deleted and deleted[0][1] == READY:
+                self.fulfill(deleted[0][0])
+        if deleted:
+            self.rerank(deleted[0][0])
+            print(f"Reservation with ID {reservation_id} deleted successfully.")
+        else:
+            print(f"Reservation with ID {reservation_id} not found.")
+
+    # Hand a returned or released copy of book_id to the oldest pending reservation,
+    # or put it back on the shelf when nobody is waiting, as LibraryManager.fulfill
+    # does. Called inside a transaction; returns (reservation_id, member_id,
+    # hold_expires) of the new hold, or None.
+    def fulfill(self, book_id):
+        pending = self.connection.execute(NEXT_PENDING, (book_id, PENDING)).fetchone()
+        if pending is None:
+            self.connection.execute("UPDATE books SET available = 1 WHERE book_id = ?", (book_id,))
+            return None
+        hold_expires = (datetime.date.today() + datetime.timedelta(days=HOLD_DAYS)).isoformat()
+        self.connection.execute(HOLD_COPY, (READY, hold_expires, pending[0]))
+        return pending + (hold_expires,)
+
+    @instrumented
+    def borrow_book(self, member_id, book_id):
+        member = self.get_member(member_id)
+        book = self.get_book(book_id)
+
+        if member and book:
+            with self.connection:
+                # A copy held for the member is collected, ending the reservation; otherwise
+                # check and claim the copy in one statement so concurrent borrowers cannot both win
+                claimed = self.connection.execute(COLLECT_HOLD, (book_id, member_id, READY)).fetchall() or \
+                    self.connection.execute(
+                        "UPDATE books SET available = 0 WHERE book_id = ? AND available = 1", (book_id,)
+                    ).rowcount
+                if claimed:
+                    borrow_id = self.next_id('borrows')
+                    borrow_date = datetime.date.today().isoformat()
+                    due_date = (datetime.date.today() + datetime.timedelta(days=30)).isoformat()
+                    self.connection.execute(INSERT_BORROW, (borrow_id, member_id, book_id, borrow_date, due_date))
+            if claimed:
+                self.rerank(book_id)
+                print(f"Book '{book.title}' borrowed successfully by {member.name}. Due date: {due_date}")
+                return
+        print("Invalid member or book, or book is not available.")
+
+    @instrumented
+    def return_book(self, borrow_id):
+        borrow = self.get_borrow(borrow_id)
+        if borrow:
+            member = self.get_member(borrow.member_id)
+            book = self.get_book(borrow.book_id)
+            if member and book:
+                with self.connection:
+                    self.connection.execute("DELETE FROM borrows WHERE borrow_id = ?", (borrow_id,))
+                    hold = self.fulfill(book.book_id)
+                self.rerank(book.book_id)
+                print(f"Book '{book.title}' returned successfully by {member.name}.")
+                if hold is not None:
+                    reservation_id, holder_id, hold_expires = hold
+                    holder = self.get_member(holder_id)
+                    print(f"Held for {holder.name if holder else 'member ' + holder_id} "
+                          f"(reservation {reservation_id}) until {hold_expires}.")
+            else:
+                print("Invalid member or book found for this borrow.")
+        else:
+            print(f"Borrow with ID {borrow_id} not found.")
+
+# One-shot copy of the .dat files (and any pending journals) in data_dir into a new database
+def migrate_from_dat(data_dir=DATA_FILES_DIR, database_file=None):
+    if database_file is None:
+        database_file = os.path.join(data_dir, DATABASE_FILE_NAME)
+    library = LibraryManager(data_dir, use_snapshot=False)
+    store = SQLiteLibraryManager(database_file)
+    with store.connection:
+        store.connection.executemany(INSERT_BOOK, (
+            (b.book_id, b.title, b.author, b.isbn, int(b.available)) for b in library.books
+        ))
+        store.connection.executemany(INSERT_MEMBER, (
+            (m.member_id, m.name, m.contact) for m in library.members
+        ))
+        store.connection.executemany(INSERT_BORROW, (
+            (b.borrow_id, b.member_id, b.book_id, b.borrow_date, b.due_date) for b in library.borrows
+        ))
+        store.connection.executemany(INSERT_RESERVATION, (
+            (r.reservation_id, r.member_id, r.book_id, r.reservation_date, r.status, r.hold_expires)
+            for r in library.reservations
+        ))
+        store.connection.executemany(
+            "INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)",
+            [
+                ('books', library.last_book_id),
+                ('members', library.last_member_id),
+                ('borrows', library.last_borrow_id),
+                ('reservations', library.last_reservation_id),
+            ],
+        )
+    library.close()
+    print(f"Migrated {len(library.books)} books, {len(library.members)} members, "
+          f"{len(library.borrows)} borrows and {len(library.reservations)} reservations to {database_file}.")
+    return store
+
+# Open the database in data_dir, first migrating the .dat files there into it when
+# it does not exist yet, so switching backends keeps the library's records
+def open_library(data_dir=DATA_FILES_DIR):
+    database_file = os.path.join(data_dir, DATABASE_FILE_NAME)
+    if os.path.exists(database_file):
+        return SQLiteLibraryManager(database_file)
+    return migrate_from_dat(data_dir, database_file)
@@ -0,0 +1,202 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import smart
+from benchmark import generate_dataset, table_sizes
+from changefeed import EVENT_TYPES, ChangeFeed, read_changes
+
+# Many threads borrowing and returning against one shared LibraryManager. Every
+# thread hammers a small set of hot books, so most borrow attempts race another
+# thread for the same book. Afterwards the manager, the files it saved and its
+# change log are checked for lost or duplicated updates.
+
+# Borrow and return books from hot_books at random for ops iterations, returning
+# (borrow attempts that succeeded, returns that succeeded)
+def worker(library, hot_books, members, ops, seed, start_barrier):
+    rng = random.Random(seed)
+    borrowed = []
+    borrows = returns = 0
+    start_barrier.wait()
+    for _ in range(ops):
+        if borrowed and rng.random() < 0.5:
+            borrow = borrowed.pop(rng.randrange(len(borrowed)))
+            if library.return_book(borrow.borrow_id):
+                returns += 1
+        else:
+            borrow = library.borrow_book(str(rng.randint(1, members)), rng.choice(hot_books))
+            if borrow:
+                borrowed.append(borrow)
+                borrows += 1
+    return borrows, returns
+
+# Invariants that a lost or duplicated update would break; returns a list of problems
+def check(library, expected_borrows, first_borrow_id, new_borrows):
+    problems = []
+    if len(library.borrows) != expected_borrows:
+        problems.append(f"{len(library.borrows)} open borrows, expected {expected_borrows}")
+    if library.last_borrow_id - first_borrow_id + 1 != new_borrows:
+        problems.append(f"{library.last_borrow_id - first_borrow_id + 1} borrow IDs issued for {new_borrows} borrows")
+
+    loans = Counter(borrow.book_id for borrow in library.borrows)
+    doubled = [book_id for book_id, count in loans.items() if count > 1]
+    if doubled:
+        problems.append(f"{len(doubled)} books lent out more than once, e.g. book {doubled[0]}")
+    wrong = [book.book_id for book in library.books
+             if book.available == (book.book_id in loans or book.book_id in library.holds_by_book)]
+    if wrong:
+        problems.append(f"{len(wrong)} books whose availability disagrees with the open borrows and holds, e.g. book {wrong[0]}")
+    available = sum(book.available for book in library.books)
+    if library.available_count != available:
+        problems.append(f"available_count is {library.available_count}, but {available} books are available")
+    return problems + check_links(library)
+
+# The relationship indexes, compared with ones rebuilt from the open borrows
+def check_links(library):
+    problems = []
+    loans = {}
+    for borrow in library.borrows:
+        loans.setdefault(borrow.member_id, set()).add(borrow.borrow_id)
+    if {member_id: set(borrows) for member_id, borrows in library.borrows_by_member.items()} != loans:
+        problems.append("borrows_by_member disagrees with the open borrows")
+    active = {borrow.book_id: borrow.borrow_id for borrow in library.borrows}
+    if {book_id: borrow.borrow_id for book_id, borrow in library.active_borrow_by_book.items()} != active:
+        problems.append("active_borrow_by_book disagrees with the open borrows")
+    wrong = [member.member_id for member in library.members
+             if Counter(book.book_id for book in member.borrowed_books)
+             != Counter(library.borrows_by_id[borrow_id].book_id for borrow_id in loans.get(member.member_id, ()))]
+    if wrong:
+        problems.append(f"{len(wrong)} members whose borrowed_books disagree with their borrows, e.g. member {wrong[0]}")
+    holds = {reservation.book_id: reservation.reservation_id for reservation in library.reservations
+             if reservation.status == smart.READY}
+    if {book_id: reservation.reservation_id for book_id, reservation in library.holds_by_book.items()} != holds:
+        problems.append("holds_by_book disagrees with the ready reservations")
+    misranked = [book.book_id for book in library.books
+                 if library.title_prefix_index.score(book.book_id) != library.book_demand(book.book_id)]
+    if misranked:
+        problems.append(f"{len(misranked)} books with a stale autocomplete rank, e.g. book {misranked[0]}")
+    return problems
+
+# What the saved files say, compared with the manager that wrote them
+def check_saved(library, data_dir, journaled):
+    reloaded = smart.LibraryManager(data_dir, journaled=journaled, use_snapshot=False)
+    problems = []
+    if set(reloaded.borrows_by_id) != set(library.borrows_by_id):
+        problems.append("saved borrows differ from the ones in memory")
+    saved = {book.book_id: book.available for book in reloaded.books}
+    if saved != {book.book_id: book.available for book in library.books}:
+        problems.append("saved book availability differs from memory")
+    problems += [f"after reloading: {problem}" for problem in check_links(reloaded)]
+    return problems
+
+# Every record as {table: {key: row as a dict of columns}}
+def table_rows(library):
+    tables = {}
+    for kind, (_, header) in smart.SNAPSHOT_TABLES.items():
+        rows = (smart.ROW_WRITERS[kind](record) for record in getattr(library, kind))
+        tables[kind] = {row[0]: dict(zip(header, row)) for row in rows}
+    return tables
+
+# The change log, replayed over the records as they were when it was started,
+# should give the records in memory now
+def check_feed(library, path, before):
+    problems = []
+    events, _ = read_changes(path)
+    if [event.sequence for event in events] != list(range(1, len(events) + 1)):
+        problems.append("change log sequence numbers are not consecutive from 1")
+    replayed = {kind: dict(rows) for kind, rows in before.items()}
+    recreated = 0
+    for event in events:
+        rows = replayed[event.table]
+        if event.type == EVENT_TYPES[event.table][0] and event.key in rows:
+            recreated += 1
+        if event.row is None:
+            rows.pop(event.key, None)
+        else:
+            rows[event.key] = event.row
+    if recreated:
+        problems.append(f"{recreated} change events create records that already exist")
+    if replayed != table_rows(library):
+        problems.append("replaying the change log does not give the records in memory")
+    return problems
+
+def run(threads, books, hot, ops, journaled, write_behind, seed):
+    sizes = table_sizes(books)
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_dataset(data_dir, books, seed)
+        library = smart.LibraryManager(data_dir, journaled=journaled, use_snapshot=False, write_behind=write_behind,
+                                       flush_interval=0.01)
+        # Books after the ones on loan in the generated data start out available
+        hot_books = [str(book_id) for book_id in range(sizes['borrows'] + 1, sizes['borrows'] + hot + 1)]
+        initial_borrows = len(library.borrows)
+        first_borrow_id = library.last_borrow_id + 1
+        before = table_rows(library)
+        feed = ChangeFeed(library, os.path.join(data_dir, 'changes.log'))
+
+        results = [None] * threads
+        start_barrier = threading.Barrier(threads + 1)
+
+        def target(number):
+            results[number] = worker(library, hot_books, sizes['members'], ops, seed + number, start_barrier)
+
+        pool = [threading.Thread(target=target, args=(number,)) for number in range(threads)]
+        for thread in pool:
+            thread.start()
+        start_barrier.wait()
+        start = time.perf_counter()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        borrows = sum(result[0] for result in results)
+        returns = sum(result[1] for result in results)
+        problems = check(library, initial_borrows + borrows - returns, first_borrow_id, borrows)
+        problems += check_feed(library, feed.path, before)
+        library.close()
+        feed.close()
+        problems += check_saved(library, data_dir, journaled)
+
+    return {
+        'threads': threads,
+        'operations': threads * ops,
+        'borrows': borrows,
+        'returns': returns,
+        'seconds': elapsed,
+        'ops_per_second': threads * ops / elapsed,
+        'problems': problems,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent borrow/return stress run for LibraryManager")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--books', type=int, default=10_000)
+    parser.add_argument('--hot', type=int, default=32, help="books every thread competes for")
+    parser.add_argument('--ops', type=int, default=500, help="borrow or return calls per thread")
+    parser.add_argument('--journaled', action='store_true', help="run mutations in journaled mode")
+    parser.add_argument('--write-behind', action='store_true', help="save through the background flusher")
+    parser.add_argument('--switch-interval', type=float, default=1e-5,
+                        help="seconds between thread switches; small values provoke more interleavings")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+    results = []
+    for threads in args.threads:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results.append(run(threads, args.books, args.hot, args.ops, args.journaled, args.write_behind, args.seed))
+    for result in results:
+        result['scaling'] = result['ops_per_second'] / results[0]['ops_per_second']
+
+    print(json.dumps({'journaled': args.journaled, 'write_behind': args.write_behind, 'books': args.books, 'results': results}, indent=2))
+    if any(result['problems'] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()